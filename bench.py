@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import numpy as np
+import sys
+import time
+
+from wfwo import metrics, oracle, sim
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-n", required=False, type=int, default=[1000, 4000, 16000], nargs="+",
+    help="Number of monitored (and unmonitored) test cases to benchmark with")
+ap.add_argument("-k", required=False, type=int, default=100,
+    help="Number of labels, the last one for unmonitored websites")
+ap.add_argument("-o", required=False, default="both", choices=["prob", "single", "both"],
+    help="Type of WF predictions to benchmark with")
+ap.add_argument("-a", required=False, type=int, default=4,
+    help="Max monitored starting Alexa rank 10^{0,a} (inclusive) for sim_wf_wo()")
+ap.add_argument("-m", required=False, default="analytic", choices=["sample", "analytic"],
+    help="Oracle mode for sim_wf_wo(), see sim.py")
+ap.add_argument("-r", required=False, type=int, default=3,
+    help="Run each benchmark this many times and report the fastest")
+ap.add_argument("-cn", required=False, type=int, default=1000,
+    help="Number of test cases for the correctness checks, 0 to skip them")
+ap.add_argument("--seed", required=False, type=int, default=0,
+    help="Seed for the synthetic data and the simulations")
+ap.add_argument("--json", required=False,
+    help="Also write all results as JSON to this file")
+ap.add_argument("-fig", required=False,
+    help="Filename for a figure of the scaling curves (pdf)")
+
+def main():
+    '''Benchmarks the hot paths of sim.py and metrics.py on synthetic data.
+
+    For each size in -n, synthetic() generates that many monitored and
+    unmonitored test cases, and each benchmark reports the fastest of -r runs
+    in seconds and as throughput (test cases, or oracle lookups, per second).
+    The scaling of each benchmark is how its time grows with the size: 1.0 is
+    linear. Before that, check() compares the code paths against reference
+    implementations, which are the straightforward loops that sim.py and
+    metrics.py started out with, under a fixed seed.
+    '''
+    if args["cn"] > 0:
+        print("checking against the reference implementations with {} test cases".format(args["cn"]))
+        if not check(args["cn"], args["k"], args["seed"]):
+            print("correctness checks failed")
+            return -1
+        print("all correctness checks passed")
+        print("")
+
+    types = ["prob", "single"] if args["o"] == "both" else [args["o"]]
+    results = {}
+    for n in args["n"]:
+        runs = list(benchmarks_oracle(n, args["k"]))
+        for single in [t == "single" for t in types]:
+            data = synthetic(n, args["k"], np.random.default_rng(args["seed"]), single)
+            runs += list(benchmarks(data, single))
+        for name, seconds, count in runs:
+            results.setdefault(name, []).append((n, seconds, count))
+            print("N = {:>8}, {:<30} {:8.4f} s, {:>14,.0f} per second".format(n, name, seconds, count/seconds))
+        print("")
+
+    print("scaling from N = {} to {}, 1.0 is linear".format(args["n"][0], args["n"][-1]))
+    for name, runs in results.items():
+        print("\t{:<30} {}".format(name, " ".join("{:5.2f}".format(s) for s in scaling(runs))))
+
+    if args["json"] is not None:
+        with open(args["json"], "w") as handle:
+            json.dump({name: [{"n": n, "seconds": s, "per_second": c/s} for n, s, c in runs]
+                for name, runs in results.items()}, handle, indent=2)
+    if args["fig"] is not None:
+        plot_scaling(results, args["fig"])
+
+def synthetic(n, k, rng, single=False):
+    '''Returns synthetic labels and predictions like load_labels() and
+    load_predictions() in sim.py: n monitored and n unmonitored test cases.
+
+    Monitored labels are in [0, k-1) and the unmonitored label is k-1. Each
+    prediction is a softmax of random scores with a boost for the correct label,
+    so that roughly two thirds of the predictions are correct, or only the label
+    with the highest probability if single.
+    '''
+    labels_mon = rng.integers(0, k-1, n)
+    labels_unmon = np.full(n, k-1)
+    predictions = []
+    for labels in [labels_mon, labels_unmon]:
+        scores = rng.normal(size=(n, k))
+        scores[np.arange(n), labels] += 2.5
+        p = sim.softmax(scores, axis=1)
+        predictions.append(np.argmax(p, axis=1) if single else p)
+    return labels_mon, labels_unmon, predictions[0], predictions[1]
+
+def timed(f, *fargs):
+    '''Returns the fastest wall time of -r calls to f(*fargs).'''
+    best = float("inf")
+    for _ in range(args["r"]):
+        start = time.perf_counter()
+        f(*fargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def quiet(f):
+    '''Returns f without its prints, for timing sim_wf_wo().'''
+    def g(*fargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return f(*fargs)
+    return g
+
+def benchmarks_oracle(n, k):
+    '''Yields the name, seconds, and number of lookups of n lookups with
+    create_oracle(), at once and one at a time, for each oracle mode.'''
+    rng = np.random.default_rng(args["seed"])
+    websites, correct = rng.integers(0, k-1, n), rng.integers(0, k-1, n)
+    for mode in ["sample", "analytic"]:
+        o, _ = oracle.create_oracle(100, 1000, rng=rng, analytic=mode == "analytic")
+        yield ("oracle.batch ({})".format(mode), timed(o.batch, websites, correct), n)
+        yield ("oracle ({})".format(mode), timed(lambda: [o(w, c) for w, c in zip(websites, correct)]), n)
+
+def benchmarks(data, single):
+    '''Yields the name, seconds, and number of test cases of each benchmark
+    for the synthetic() data.'''
+    labels_mon, labels_unmon, pred_mon, pred_unmon = data
+    n, unmon_label, kind = len(labels_mon), labels_unmon[0], "single" if single else "prob"
+    rng = np.random.default_rng(args["seed"])
+    analytic = args["m"] == "analytic"
+
+    yield ("sim_wf_wo ({})".format(kind), timed(quiet(sim.sim_wf_wo), labels_mon, labels_unmon,
+        pred_mon, pred_unmon, 100, 1.0, 0.0, 1.0, args["a"], True, 1, args["seed"], analytic), 2*n)
+
+    if single:
+        o, _ = oracle.create_oracle(100, 1000, rng=rng, analytic=analytic)
+        yield ("wf_wo_single", timed(sim.wf_wo_single, o, pred_mon, labels_mon, unmon_label), n)
+        yield ("simple_metrics", timed(metrics.simple_metrics, pred_mon, labels_mon, pred_unmon, labels_unmon), 2*n)
+    else:
+        o, _ = oracle.create_oracle(100, 1000, rng=rng, analytic=analytic)
+        yield ("wf_wo_list_prob", timed(sim.wf_wo_list_prob, o, pred_mon, labels_mon, unmon_label), n)
+        yield ("metrics", timed(metrics.metrics, 0.5, pred_mon, labels_mon, pred_unmon, labels_unmon), 2*n)
+        summary = metrics.summarize(pred_mon), metrics.summarize(pred_unmon)
+        yield ("metrics_curve (16 thresholds)", timed(metrics.metrics_curve, metrics.thresholds(16),
+            summary[0], labels_mon, summary[1], labels_unmon), 2*n)
+
+def scaling(runs):
+    '''Returns the slope of log time over log size between each pair of sizes.'''
+    return [np.log(s2/s1) / np.log(n2/n1) for (n1, s1, _), (n2, s2, _) in zip(runs, runs[1:])]
+
+def plot_scaling(results, filename):
+    import matplotlib.pyplot as plt # only needed for the figure
+    fig, ax = plt.subplots()
+    for name, runs in results.items():
+        ax.loglog([r[0] for r in runs], [r[1] for r in runs], marker="o", label=name)
+    ax.set_xlabel("N")
+    ax.set_ylabel("seconds")
+    ax.legend(fontsize=7)
+    plt.savefig(filename, bbox_inches="tight")
+
+def check(n, k, seed):
+    '''Compares sim.py and metrics.py against the reference implementations.
+
+    The oracle is deterministic for these checks (probability 1, no false
+    positives, and a lazy Tor network at Alexa rank 1000 drawn with the seed),
+    so the reference loops asking the oracle once per call get the same answers
+    as the code asking oracle.batch() all at once, and the simulated
+    predictions must be identical. The metrics must be identical as well. Only
+    the visits over Tor are random, so they are compared by their distribution.
+    '''
+    ok = True
+    def report(name, passed):
+        print("\t{:<40} {}".format(name, "OK" if passed else "FAILED"))
+        return passed
+
+    def deterministic():
+        return oracle.create_oracle(100, 1000, rng=np.random.default_rng(seed))[0]
+
+    for single in [True, False]:
+        labels_mon, labels_unmon, pred_mon, pred_unmon = synthetic(n, k, np.random.default_rng(seed), single)
+        unmon_label = labels_unmon[0]
+        if single:
+            for pred, labels in [(pred_mon, labels_mon), (pred_unmon, labels_unmon)]:
+                ok &= report("wf_wo_single", np.array_equal(
+                    sim.wf_wo_single(deterministic(), pred, labels, unmon_label),
+                    ref_wf_wo_single(deterministic(), pred, labels, unmon_label)))
+            ok &= report("simple_metrics", np.allclose(
+                metrics.simple_metrics(pred_mon, labels_mon, pred_unmon, labels_unmon),
+                ref_simple_metrics(pred_mon, labels_mon, pred_unmon, labels_unmon), rtol=0, atol=1e-12))
+        else:
+            for pred, labels in [(pred_mon, labels_mon), (pred_unmon, labels_unmon)]:
+                ok &= report("wf_wo_list_prob", np.array_equal(
+                    sim.wf_wo_list_prob(deterministic(), pred, labels, unmon_label),
+                    ref_wf_wo_list_prob(deterministic(), pred, labels, unmon_label)))
+            for threshold in metrics.thresholds(16):
+                ok &= report("metrics (threshold {:.3})".format(threshold), np.allclose(
+                    metrics.metrics(threshold, pred_mon, labels_mon, pred_unmon, labels_unmon),
+                    ref_metrics(threshold, pred_mon, labels_mon, pred_unmon, labels_unmon), rtol=0, atol=1e-12))
+
+    # bucket frequencies of many visits within 5 standard deviations
+    visits = 1000*1000
+    rng = np.random.default_rng(seed)
+    batch = oracle.pop_mani_wilsonbrown_et_al_batch(visits, rng)
+    scalar = np.array([oracle.pop_mani_wilsonbrown_et_al(rng) for _ in range(visits // 10)])
+    for name, v in [("pop_mani_wilsonbrown_et_al_batch", batch), ("pop_mani_wilsonbrown_et_al", scalar)]:
+        bucket = np.where(v == oracle.POP_BUCKET_HIGH[0], 0,
+                          np.searchsorted(oracle.POP_BUCKET_HIGH[1:], v, side="left") + 1)
+        freq = np.bincount(bucket, minlength=8) / len(v)
+        sd = np.sqrt(oracle.POP_BUCKET_P * (1-oracle.POP_BUCKET_P) / len(v))
+        ok &= report("{} buckets".format(name), np.all(np.abs(freq - oracle.POP_BUCKET_P) < 5*sd))
+    return ok
+
+def ref_wf_wo_single(oracle, predictions, labels, unmon_label):
+    '''The reference for sim.wf_wo_single().'''
+    predictions_updated = np.array(predictions)
+    for i in range(len(predictions)):
+        if predictions[i] >= unmon_label or oracle(predictions[i], labels[i]):
+            continue
+        predictions_updated[i] = unmon_label
+    return predictions_updated
+
+def ref_wf_wo_list_prob(oracle, predictions, labels, unmon_label):
+    '''The reference for sim.wf_wo_list_prob().'''
+    predictions_updated = np.array(predictions)
+    for i in range(len(predictions)):
+        label_correct = labels[i]
+        for _ in range(len(predictions[i])):
+            label_pred = np.argmax(predictions_updated[i])
+            if label_pred >= unmon_label or oracle(label_pred, label_correct):
+                break
+            predictions_updated[i][label_pred] = 0.0
+            predictions_updated[i] = sim.softmax(predictions_updated[i]*5 / max(predictions_updated[i]))
+    return predictions_updated
+
+def ref_metrics(threshold, predictions_mon, labels_mon, predictions_unmon, labels_unmon):
+    '''The reference for metrics.metrics().'''
+    tp, fpp, fnp, tn, fn, accuracy, recall, precision = 0, 0, 0, 0, 0, 0.0, 0.0, 0.0
+    for i in range(len(predictions_mon)):
+        label_pred = np.argmax(predictions_mon[i])
+        prob_pred = max(predictions_mon[i])
+        if prob_pred >= threshold and label_pred == labels_mon[i]:
+            tp = tp + 1
+        elif prob_pred >= threshold and label_pred in labels_mon:
+            fpp = fpp + 1
+        else:
+            fn = fn + 1
+    for i in range(len(predictions_unmon)):
+        label_pred = np.argmax(predictions_unmon[i])
+        prob_pred = max(predictions_unmon[i])
+        if prob_pred < threshold or label_pred in labels_unmon:
+            tn = tn + 1
+        elif label_pred < labels_unmon[0]:
+            fnp = fnp + 1
+        else:
+            sys.exit("wrongly labelled data? got label %d" % (label_pred))
+    if tp + fn + fpp > 0:
+        recall = float(tp) / float(tp + fn + fpp)
+    if tp + fpp + fnp > 0:
+        precision = float(tp) / float(tp + fpp + fnp)
+    accuracy = float(tp + tn) / float(tp + fpp + fnp + fn + tn)
+    return tp, fpp, fnp, tn, fn, accuracy, recall, precision
+
+def ref_simple_metrics(predictions_mon, labels_mon, predictions_unmon, labels_unmon):
+    '''The reference for metrics.simple_metrics().'''
+    tp, fpp, fnp, tn, fn, accuracy, recall, precision = 0, 0, 0, 0, 0, 0.0, 0.0, 0.0
+    for i in range(len(predictions_mon)):
+        label_pred = predictions_mon[i]
+        if label_pred == labels_mon[i]:
+            tp = tp + 1
+        elif label_pred in labels_mon:
+            fpp = fpp + 1
+        else:
+            fn = fn + 1
+    for i in range(len(predictions_unmon)):
+        label_pred = predictions_unmon[i]
+        if label_pred in labels_unmon:
+            tn = tn + 1
+        elif label_pred < labels_unmon[0]:
+            fnp = fnp + 1
+        else:
+            sys.exit("wrongly labelled data? got label %d" % (label_pred))
+    if tp + fn + fpp > 0:
+        recall = float(tp) / float(tp + fn + fpp)
+    if tp + fpp + fnp > 0:
+        precision = float(tp) / float(tp + fpp + fnp)
+    accuracy = float(tp + tn) / float(tp + fpp + fnp + fn + tn)
+    return tp, fpp, fnp, tn, fn, accuracy, recall, precision
+
+if __name__ == "__main__":
+    args = vars(ap.parse_args())
+    main()
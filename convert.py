@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import argparse
+import numpy as np
+import pickle
+
+ap = argparse.ArgumentParser()
+ap.add_argument("-lm", required=False,
+    help="File with monitored testing labels (pickle)")
+ap.add_argument("-lu", required=False,
+    help="File with unmonitored testing labels (pickle)")
+ap.add_argument("-lp", required=False,
+    help="File with pre-computed predictions from the WF attack (pickle)")
+
+def main():
+    '''Converts pickled labels and predictions to .npy files for sim.py and
+    metrics.py.
+
+    Each file is written next to the pickle with the .pkl extension replaced by
+    .npy. Labels become an int32 vector. The monitored and unmonitored
+    predictions become one array with the monitored predictions first: an
+    (N, K) matrix of probabilities (keeping their float type) or an int32
+    vector of single labels. sim.py and metrics.py memory-map .npy files and
+    split the predictions using the number of monitored labels.
+    '''
+    for name in ["lm", "lu"]:
+        if args[name] is not None:
+            with open(args[name], 'rb') as handle:
+                labels = np.array(pickle.load(handle))
+            save(args[name], to_int32(labels))
+
+    if args["lp"] is not None:
+        with open(args["lp"], 'rb') as handle:
+            pred_mon, pred_unmon = pickle.load(handle)
+        predictions = np.concatenate([np.asarray(pred_mon), np.asarray(pred_unmon)])
+        if np.issubdtype(predictions.dtype, np.integer):
+            predictions = to_int32(predictions)
+        print("{} monitored and {} unmonitored predictions".format(len(pred_mon), len(pred_unmon)))
+        save(args["lp"], predictions)
+
+def to_int32(a):
+    if a.min() < np.iinfo(np.int32).min or a.max() > np.iinfo(np.int32).max:
+        return a
+    return a.astype(np.int32)
+
+def save(filename, a):
+    out = filename[:-len(".pkl")] if filename.endswith(".pkl") else filename
+    print("saving {} {} to {}.npy".format(a.shape, a.dtype, out))
+    np.save("{}.npy".format(out), a)
+
+if __name__ == "__main__":
+    args = vars(ap.parse_args())
+    main()
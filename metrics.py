@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import argparse
-import numpy as np
-import pickle
 import sys
-import matplotlib.pyplot as plt
+
+from wfwo import cache, data, plot, profiling
+from wfwo.data import load_array, load_repetitions, load_results, summarize
+from wfwo.metrics import curve_band, curve_point, label_lookup, metrics_curve, metrics_curves, thresholds
 
 ap = argparse.ArgumentParser()
 ap.add_argument("-lm", required=True, 
@@ -21,212 +22,227 @@ ap.add_argument("-o", required=False, default="example",
     help="Filename for the figure output")
 ap.add_argument("-wl", required=False, default="WF",
     help="WF label in produced graphs")    
-args = vars(ap.parse_args())
-
-# values for styling graphs
-linestyles = [":", "--", "-.", "-", "-.", "-", ":", "--"]
-markerstyles = ['o', 's', 'v', '^', '<', '>', '*', 's', 'p', '*', 'h', 'H', 'D', 'd']
-legends = [args["wl"], '1', '10', '100', '1k', '10k', '100k']
-colors = ['#d44f7e', '#ffd03d', '#2fb651', '#fb8134', '#7556a2', '#5bb2e5']
+ap.add_argument("-th", required=False, type=int, default=16,
+    help="Number of thresholds for the precision-recall curve")
+ap.add_argument("-k", required=False,
+    help="Config t,p,f,c to use if -p is a sweep of configs from sim.py")
+ap.add_argument("-ci", required=False, type=float, default=95,
+    help="Confidence level in percent of the intervals if -p has repetitions from sim.py")
+ap.add_argument("-j", "--jobs", required=False, type=int, default=1,
+    help="Number of processes to compute the metrics of popularity levels (and -wf) with")
+ap.add_argument("--profile", required=False,
+    help="Write a JSON report with the time and peak memory of each stage to this file")
+ap.add_argument("--cache", required=False,
+    help="Directory to cache the metrics of each popularity level of -p in, to only compute new levels, and not load -p again when only, e.g., -d or -wf change")
+ap.add_argument("--cache-size", required=False, type=float, default=1024,
+    help="Max size of the cache in MB, evicting the least recently used metrics first")
 
 def main():
-    print("loading labels")
-    labels_mon, labels_unmon = load_labels()
-
-    print("loading predictions")
-    predictions, wf_predictions = [], []
-    predictions = load_predictions()
-    if args["wf"] is not None:
-        wf_predictions = load_wf_predictions()
+    plot.legends[0] = args["wl"]
+    with profiling.stage("load labels"):
+        print("loading labels")
+        labels_mon, labels_unmon = load_labels()
+        lookups = label_lookup(labels_mon), label_lookup(labels_unmon)
+
+    with profiling.stage("load repetitions"):
+        repetitions = load_repetitions(args["p"])
+    if repetitions is not None:
+        repetitions_main(repetitions, labels_mon, labels_unmon, lookups)
+        return
+    prob, levels, wf_metrics = load_metrics(labels_mon, labels_unmon)
 
     # simulated Alexa popularity from sim_wf+wo.py
-    popularity = [pow(10,i) for i in range(0,len(predictions))]
+    popularity = [pow(10,i) for i in range(0,len(levels))]
 
     # if the output has probabilities, then we can use a threshold and also
     # generate pretty precision-recall curves
-    if pred_type_list_of_prob(predictions[0][0]):
+    if prob:
         # create the shell for our results figure
-        plotstyle() # intended, due to matplotlib shenanigans
-        fig, ax = plt.subplots()
-        fig.set_size_inches(5,3)
-        plotstyle() # intended, due to matplotlib shenanigans
+        fig, ax = plot.figure(args["d"])
 
-        threshold = np.append([0], 1.0 - 1 / np.logspace(0.05, 2, num=15, 
-        endpoint=True))
+        threshold = thresholds(args["th"])
         if args["wf"] is not None:
             print("")
             print("first computing WF without WO metrics with threshold")
-            all_precision, all_recall = [], []
-            for th in threshold:
-                tp, fpp, fnp, tn, fn, accuracy, recall, precision = metrics(th, wf_predictions[0], labels_mon, wf_predictions[1], labels_unmon)
-                all_precision.append(precision)
-                all_recall.append(recall)
-                print("\tthreshold {:4.2}, recall {:4.2}, precision {:4.2}, accuracy {:4.2}\t [tp {:>6}, fpp {:>6}, fnp {:>6}, tn {:>6}, fn {:>6}]".format(th, recall, precision, accuracy, tp, fpp, fnp, tn, fn))
+            print_curve(threshold, wf_metrics)
 
             print(" ")
-            ax.plot(all_recall, all_precision, label=legends[0], ls=linestyles[0], marker=markerstyles[0], color=colors[0])
+            plot.plot_curve(ax, wf_metrics, 0)
 
         print("computing WF+WO metrics for different Alexa ranks and thresholds")
         print("")
         for i, pop in enumerate(popularity):
-            print("WF+WO at simulated starting monitored Alexa rank {:,}, WO calls per label for monitored ({:.2}) and unmonitored ({:.2}) datasets".format(pop, float(predictions[i][2])/float(len(labels_mon)), float(predictions[i][3])/float(len(labels_unmon))))
-            all_precision, all_recall = [], []
-            for th in threshold:
-                tp, fpp, fnp, tn, fn, accuracy, recall, precision = metrics(th, predictions[i][0], labels_mon, predictions[i][1], labels_unmon)
-                all_precision.append(precision)
-                all_recall.append(recall)
-                print("\tthreshold {:4.2}, recall {:4.2}, precision {:4.2}, accuracy {:4.2}\t [tp {:>6}, fpp {:>6}, fnp {:>6}, tn {:>6}, fn {:>6}]".format(th, recall, precision, accuracy, tp, fpp, fnp, tn, fn))
+            mon_counter, unmon_counter, curve = levels[i]
+            print("WF+WO at simulated starting monitored Alexa rank {:,}, WO calls per label for monitored ({:.2}) and unmonitored ({:.2}) datasets".format(pop, float(mon_counter)/float(len(labels_mon)), float(unmon_counter)/float(len(labels_unmon))))
+            print_curve(threshold, curve)
 
             print(" ")
-            ax.plot(all_recall, all_precision, label=legends[1+i], ls=linestyles[1+i], marker=markerstyles[1+i], color=colors[1+i])
+            plot.plot_curve(ax, curve, 1+i)
         
         # plot setting that has to be here and then save results
-        ax.legend(facecolor='#f7f7f7', ncol=2)
-        plt.savefig("{}.pdf".format(args["o"]), bbox_inches='tight')
+        with profiling.stage("save figure"):
+            plot.save(ax, "{}.pdf".format(args["o"]))
 
     # if we only have a single prediction per test then only simple metrics
-    if pred_type_single_pred(predictions[0][0]):
+    else:
         
         if args["wf"] is not None:
             print("metrics for WF only:")
-            tp, fpp, fnp, tn, fn, accuracy, recall, precision = simple_metrics(wf_predictions[0], labels_mon, wf_predictions[1], labels_unmon)
+            tp, fpp, fnp, tn, fn, accuracy, recall, precision = wf_metrics
             print("recall {:4.2}, precision {:4.2}, accuracy {:4.2}\t [tp {:>6}, fpp {:>6}, fnp {:>6}, tn {:>6}, fn {:>6}]".format(recall, precision, accuracy, tp, fpp, fnp, tn, fn))
             print("")
             print("metrics for simulated WF+WO:")
 
         # metrics for each simulated Alexa rank
         for i, pop in enumerate(popularity):
-            tp, fpp, fnp, tn, fn, accuracy, recall, precision = simple_metrics(predictions[i][0], labels_mon, predictions[i][1], labels_unmon)
+            tp, fpp, fnp, tn, fn, accuracy, recall, precision = levels[i][2]
             print("Alexa rank {:,}, recall {:4.2}, precision {:4.2}, accuracy {:4.2}\t [tp {:>6}, fpp {:>6}, fnp {:>6}, tn {:>6}, fn {:>6}]".format(pop, recall, precision, accuracy, tp, fpp, fnp, tn, fn))
 
 
-def load_labels():
-    '''Loads all testing labels. Same format expected as in sim_wf+wo.py.'''
-    with open(args["lm"], 'rb') as handle: 
-        labels_mon = list(np.array(pickle.load(handle)))
-    with open(args["lu"], 'rb') as handle:
-        labels_unmon = list(np.array(pickle.load(handle)))
-    return labels_mon, labels_unmon
-
-def load_predictions():
-    return pickle.load(open(args["p"], "rb"))
-
-def load_wf_predictions():
-    return pickle.load(open(args["wf"], "rb"))
-
-def metrics(threshold, predictions_mon, labels_mon, predictions_unmon, labels_unmon):
-    ''' Computes a range of metrics.
+def repetitions_main(repetitions, labels_mon, labels_unmon, lookups):
+    '''Like main(), but for the output of sim.py with repetitions (-r).
 
-    For details on the metrics, see, e.g., https://www.cs.kau.se/pulls/hot/baserate/
+    Prints the mean and confidence interval of the recall and precision at
+    each popularity level and threshold, and for probabilities plots the mean
+    precision-recall curves with a band for the interval of the precision.
     '''
-    tp, fpp, fnp, tn, fn, accuracy, recall, precision = 0, 0, 0, 0, 0, 0.0, 0.0, 0.0
-
-    for i in range(len(predictions_mon)): # monitored
-        label_pred = np.argmax(predictions_mon[i])
-        prob_pred = max(predictions_mon[i])
-
-        # either confident and correct,
-        if prob_pred >= threshold and label_pred == labels_mon[i]:
-            tp = tp + 1
-        # confident and wrong monitored label, or
-        elif prob_pred >= threshold and label_pred in labels_mon:
-            fpp = fpp + 1
-        # simply wrong because not confident or predicted unmonitored for monitored
-        else:
-            fn = fn + 1
-
-    for i in range(len(predictions_unmon)): # unmonitored
-        label_pred = np.argmax(predictions_unmon[i])
-        prob_pred = max(predictions_unmon[i])
-
-        if prob_pred < threshold or label_pred in labels_unmon: # correct prediction?
-            tn = tn + 1
-        elif label_pred < labels_unmon[0]: # predicted monitored for unmonitored
-            fnp = fnp + 1
-        else: # this should never happen
-            print("this should never, wrongly labelled data? got label %d" % (label_pred))
-            sys.exit(-1)
+    recall, precision = repetitions["recall"], repetitions["precision"]
+    print("loaded {} repetitions, {}% confidence intervals in brackets".format(len(recall), args["ci"]))
+    threshold = repetitions.get("thresholds", [0.0])
 
-    if tp + fn + fpp > 0:
-        recall = float(tp) / float(tp + fn + fpp)
-    if tp + fpp + fnp > 0:
-        precision = float(tp) / float(tp + fpp + fnp)
+    if "thresholds" in repetitions:
+        fig, ax = plot.figure(args["d"])
 
-    accuracy = float(tp + tn) / float(tp + fpp + fnp + fn + tn)
+        if args["wf"] is not None:
+            print("")
+            print("first computing WF without WO metrics with threshold")
+            wf_predictions = load_wf_predictions(len(labels_mon))
+            curve = metrics_curve(threshold, summarize(wf_predictions[0]), labels_mon, summarize(wf_predictions[1]), labels_unmon, *lookups)
+            print_curve(threshold, curve)
+            plot.plot_curve(ax, curve, 0)
+
+    print("")
+    for i, pop in enumerate(repetitions["popularity"]):
+        print("WF+WO at simulated starting monitored Alexa rank {:,}, mean WO calls per label for monitored ({:.2}) and unmonitored ({:.2}) datasets".format(pop, repetitions["mon_counter"][:, i].mean()/len(labels_mon), repetitions["unmon_counter"][:, i].mean()/len(labels_unmon)))
+        band_recall = curve_band(recall[:, i], args["ci"])
+        band_precision = curve_band(precision[:, i], args["ci"])
+        for th, r, p in zip(threshold, zip(*band_recall), zip(*band_precision)):
+            print("\tthreshold {:4.2}, recall {:4.2} [{:4.2}, {:4.2}], precision {:4.2} [{:4.2}, {:4.2}]".format(th, *r, *p))
+        print(" ")
+        if "thresholds" in repetitions:
+            plot.plot_band(ax, band_recall, band_precision, 1+i)
+
+    if "thresholds" in repetitions:
+        plot.save(ax, "{}.pdf".format(args["o"]))
+
+def load_metrics(labels_mon, labels_unmon):
+    '''Returns if the simulated predictions have probabilities, for each
+    popularity level the WO calls for the monitored and unmonitored datasets
+    and the metrics, and the metrics of -wf (None if not given). The metrics
+    are the metrics_curve() at -th thresholds, or the simple_metrics() for
+    single labels, all computed by metrics_curves() with -j processes.
+
+    With --cache, the metrics of each level are cached by its predictions, the
+    labels, and -th, so that only levels not seen before are computed, e.g.,
+    when -p is simulated again with a larger -a. An index of the levels is
+    cached by the contents of -p and -k as well, so that changing only how
+    the metrics are presented does not load and summarize -p again.
+    '''
+    index_key, index = None, None
+    if args["cache"] is not None:
+        labels = cache.digest(labels_mon, labels_unmon)
+        index_key = cache.digest("metrics.py index", cache.digest_file(args["p"]), args["k"], labels, args["th"])
+        index = cache.load(args["cache"], index_key)
+        if index is not None:
+            cached = [cache.load(args["cache"], key) for _, _, key in index[1]]
+            if all(m is not None for m in cached):
+                print("loaded metrics from the cache")
+            else: # some level was evicted, so load -p again
+                index = None
+
+    summaries, ranks, keys = [], [], []
+    if index is None:
+        with profiling.stage("load predictions"):
+            print("loading predictions")
+            predictions = load_predictions()
+        prob = predictions[0][0][1] is not None
+        cached = [None]*len(predictions)
+        for i, level in enumerate(predictions):
+            if index_key is not None:
+                (label_mon, prob_mon), (label_unmon, prob_unmon) = level[:2]
+                keys.append(cache.digest("metrics.py level", label_mon, prob_mon,
+                    label_unmon, prob_unmon, labels, args["th"]))
+                cached[i] = cache.load(args["cache"], keys[-1])
+            if cached[i] is None:
+                summaries.append(level[:2])
+                ranks.append(pow(10,i))
+        if index_key is not None:
+            print("loaded the metrics of {} of {} popularity levels from the cache".format(len(predictions)-len(summaries), len(predictions)))
+    else:
+        prob = index[0]
+    if args["wf"] is not None:
+        with profiling.stage("load WF predictions"):
+            wf_predictions = load_wf_predictions(len(labels_mon))
+            summaries.append((summarize(wf_predictions[0]), summarize(wf_predictions[1])))
+            ranks.append(None)
+
+    threshold = thresholds(args["th"]) if prob else [0.0]
+    curves = metrics_curves(threshold, summaries, labels_mon, labels_unmon, args["jobs"], ranks)
+    if not prob:
+        curves = [curve_point(curve) for curve in curves]
+    wf_metrics = curves.pop() if args["wf"] is not None else None
+
+    if index is not None:
+        return prob, [(mon_counter, unmon_counter, m) for (mon_counter, unmon_counter, _), m in zip(index[1], cached)], wf_metrics
+    computed = iter(curves)
+    levels = []
+    for i, (_, _, mon_counter, unmon_counter) in enumerate(predictions):
+        if cached[i] is None:
+            cached[i] = next(computed)
+            if index_key is not None:
+                cache.store(args["cache"], keys[i], cached[i], int(args["cache_size"]*1024*1024))
+        levels.append((mon_counter, unmon_counter, cached[i]))
+    if index_key is not None:
+        cache.store(args["cache"], index_key, (prob, [(mon_counter, unmon_counter, key)
+            for (mon_counter, unmon_counter, _), key in zip(levels, keys)]), int(args["cache_size"]*1024*1024))
+    return prob, levels, wf_metrics
 
-    return tp, fpp, fnp, tn, fn, accuracy, recall, precision
+def load_labels():
+    '''Loads all testing labels. Same format expected as in sim_wf+wo.py.'''
+    return load_array(args["lm"]), load_array(args["lu"])
 
-def simple_metrics(predictions_mon, labels_mon, predictions_unmon, labels_unmon):
-    ''' Computes a range of metrics, but without support for a threshold. 
+def load_predictions():
+    '''Loads the simulated predictions from sim.py.
 
-    For details on the metrics, see, e.g.,
-    https://www.cs.kau.se/pulls/hot/baserate/ . This function is as close as
-    possible to metrics() for sake of ease of comparison.
+    See load_results(), and for a sweep of configs, this picks the one given
+    to -k.
     '''
-    tp, fpp, fnp, tn, fn, accuracy, recall, precision = 0, 0, 0, 0, 0, 0.0, 0.0, 0.0
-
-    for i in range(len(predictions_mon)): # monitored
-        label_pred = predictions_mon[i]
-
-        # correct,
-        if label_pred == labels_mon[i]:
-            tp = tp + 1
-        # wrong monitored label, or
-        elif label_pred in labels_mon:
-            fpp = fpp + 1
-        # wrong because predicted unmonitored for monitored
-        else:
-            fn = fn + 1
-
-    for i in range(len(predictions_unmon)): # unmonitored
-        label_pred = predictions_unmon[i]
-
-        if label_pred in labels_unmon: # correct prediction?
-            tn = tn + 1
-        elif label_pred < labels_unmon[0]: # predicted monitored for unmonitored
-            fnp = fnp + 1
-        else: # this should never happen
-            print("this should never, wrongly labelled data? got label %d" % (label_pred))
+    results = load_results(args["p"])
+    if type(results) is dict:
+        configs = {",".join(str(v) for v in config): config for config in results}
+        if args["k"] not in configs:
+            print("-p is a sweep, pick a config with -k from: {}".format(" ".join(configs)))
             sys.exit(-1)
+        results = results[configs[args["k"]]]
+    return results
+
+def load_wf_predictions(num_mon):
+    '''Loads the WF predictions. Same formats supported as in sim_wf+wo.py.'''
+    return data.load_predictions(args["wf"], num_mon)
 
-    if tp + fn + fpp > 0:
-        recall = float(tp) / float(tp + fn + fpp)
-    if tp + fpp + fnp > 0:
-        precision = float(tp) / float(tp + fpp + fnp)
-
-    accuracy = float(tp + tn) / float(tp + fpp + fnp + fn + tn)
-
-    return tp, fpp, fnp, tn, fn, accuracy, recall, precision
-
-def pred_type_single_pred(pred):
-    '''Checks if each prediction is just a single integer.'''
-    return type(pred[0]) in [int, np.int, np.int32, np.int64]
-
-def pred_type_list_of_prob(pred):
-    '''Checks if each prediction is a list of floats for common types.'''
-    return type(pred[0]) in [list, np.array, np.ndarray] and type(pred[0][0]) in [float, np.float, np.float32, np.float64]
-
-def plotstyle():
-    '''Sets a number of parameters for our graphs away from main()'''
-    plt.style.use('ggplot')
-    
-    # uncomment below if you need TrueType Type 1 complaint fonts (looks a bit ugly)
-    #plt.rcParams['pdf.fonttype'] = 42
-    #plt.rcParams['ps.fonttype'] = 42
-
-    plt.rcParams['lines.linewidth'] = 2
-    plt.rcParams['font.size'] = 12
-    plt.rcParams['xtick.labelsize'] = 12
-    plt.rcParams['ytick.labelsize'] = 12
-    plt.rcParams['legend.fontsize'] = 12
-    plt.rcParams['axes.labelsize'] = 14
-    plt.rcParams['axes.titlesize'] = 14
-    plt.rcParams['axes.facecolor'] = '#fbfbfb'
-    plt.xlabel('Recall', color=[0, 0, 0, 1])
-    plt.ylabel('Precision', color=[0, 0, 0, 1])
-    if args["d"] is not None:
-        plt.title(args["d"])
-    plt.tight_layout()
+def print_curve(thresholds, curve):
+    '''Prints the output of metrics_curve(), one line per threshold.'''
+    for th, (tp, fpp, fnp, tn, fn, accuracy, recall, precision) in zip(thresholds, zip(*curve)):
+        print("\tthreshold {:4.2}, recall {:4.2}, precision {:4.2}, accuracy {:4.2}\t [tp {:>6}, fpp {:>6}, fnp {:>6}, tn {:>6}, fn {:>6}]".format(th, recall, precision, accuracy, tp, fpp, fnp, tn, fn))
 
 if __name__ == "__main__":
-    main()
+    args = vars(ap.parse_args())
+    if args["profile"] is not None:
+        profiling.start()
+    try:
+        main()
+    except ValueError as e: # wrongly labelled data, see metrics_curve()
+        print(e)
+        sys.exit(-1)
+    if args["profile"] is not None:
+        profiling.save(args["profile"], script="metrics.py", args=args)
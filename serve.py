@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+
+from wfwo import plot
+from wfwo.data import check_datatypes, load_array, load_predictions, summarize
+from wfwo.metrics import metrics_curves
+from wfwo.sim import evaluate
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--socket", required=False,
+    help="Unix socket to listen on for jobs, instead of reading them from stdin")
+ap.add_argument("-j", "--jobs", required=False, type=int, default=1,
+    help="Number of processes to run jobs with, each job on the same dataset going to the same one")
+ap.add_argument("--datasets", required=False, type=int, default=4,
+    help="Number of datasets each process keeps loaded between jobs")
+ap.add_argument("--cache", required=False,
+    help="Directory to cache simulated popularity levels and their metrics in, see sim.py")
+ap.add_argument("--cache-size", required=False, type=float, default=1024,
+    help="Max size of the cache in MB, evicting the least recently used levels first")
+
+# the parameters of a job and their defaults, named like the flags of sim.py
+# and metrics.py: labels (lm, lu) and predictions (lp) are required, and wf is
+# the WF predictions to compare with (usually the same file as lp)
+JOB_DEFAULTS = {"id": None, "t": 100, "p": 1.0, "f": 0.0, "c": 1.0, "a": 4,
+    "z": True, "m": "sample", "seed": None, "th": 16, "wf": None,
+    "o": None, "d": "WF+WO, timeframe 100ms", "wl": "WF"}
+
+def main():
+    '''Runs WF+WO simulations and their metrics as a service.
+
+    Each job is a JSON object on one line, with the paths to the labels and
+    predictions and the parameters of sim.py and metrics.py, see JOB_DEFAULTS,
+    e.g.:
+
+      {"id": "df_nodef", "lm": "mon.npy", "lu": "unmon.npy", "lp": "pred.npy", "t": 200}
+
+    Jobs are read from stdin until it is closed, or from each connection to
+    --socket, and run concurrently by -j processes. Each process keeps the
+    last --datasets datasets it loaded in memory, and all jobs on a dataset
+    are run by the process it was first given to, so loading it and starting
+    Python is only paid once, not per job or process. Jobs with unknown
+    parameters are failed rather than run with defaults. For each job, a line
+    with its id and "status" is written back when it is queued, and another
+    when it is "done" (with the metrics of each popularity level, like
+    wfwo.evaluate()) or failed with an "error", in the order jobs finish.
+    Everything else, like the progress of the simulations, goes to stderr.
+    '''
+    # spawned rather than forked, so that processes started while serving a
+    # connection do not inherit its socket and keep it open once it is done
+    context = multiprocessing.get_context("spawn")
+    with contextlib.ExitStack() as stack:
+        pool = Pool([stack.enter_context(concurrent.futures.ProcessPoolExecutor(1, context, worker_init, (args,)))
+                     for _ in range(max(1, args["jobs"]))])
+        if args["socket"] is None:
+            asyncio.run(serve_stdin(pool))
+        else:
+            asyncio.run(serve_socket(pool))
+
+async def serve_stdin(pool):
+    loop = asyncio.get_running_loop()
+    def readline():
+        return loop.run_in_executor(None, sys.stdin.readline)
+    def send(message):
+        sys.stdout.write(json.dumps(message) + "\n")
+        sys.stdout.flush()
+    await serve(pool, readline, send)
+
+async def serve_socket(pool):
+    async def connection(reader, writer):
+        def send(message):
+            if not writer.is_closing():
+                writer.write((json.dumps(message) + "\n").encode())
+        await serve(pool, reader.readline, send)
+        await writer.drain()
+        writer.close()
+
+    if os.path.exists(args["socket"]):
+        os.remove(args["socket"])
+    server = await asyncio.start_unix_server(connection, path=args["socket"])
+    print("listening for jobs on {}".format(args["socket"]), file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+class Pool:
+    '''Single-process executors that jobs are routed to by their dataset.
+
+    A dataset (its lm, lu, and lp paths) is given to the executor with the
+    fewest unfinished jobs the first time it is seen, and every later job on
+    it goes to the same executor, which has it loaded. Datasets are
+    forgotten once more of them have been seen than all executors keep
+    loaded (see --datasets), so that a new dataset may go elsewhere.
+    '''
+    def __init__(self, executors):
+        self.executors = executors
+        self.unfinished = [0]*len(executors)
+        self.routes = collections.OrderedDict()
+
+    async def run(self, fn, job):
+        key = job["lm"], job["lu"], job["lp"]
+        if key in self.routes:
+            self.routes.move_to_end(key)
+        else:
+            self.routes[key] = self.unfinished.index(min(self.unfinished))
+            while len(self.routes) > len(self.executors)*args["datasets"]:
+                self.routes.popitem(last=False)
+        i = self.routes[key]
+        self.unfinished[i] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executors[i], fn, job)
+        finally:
+            self.unfinished[i] -= 1
+
+async def serve(pool, readline, send):
+    '''Reads jobs with readline() until the end, runs each in the pool, and
+    send()s the answers. Returns once all jobs are done.'''
+    pending = set()
+    while True:
+        line = await readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("a job is a JSON object")
+        except ValueError as e:
+            send({"id": None, "status": "error", "error": "invalid job: {}".format(e)})
+            continue
+        task = asyncio.ensure_future(run(pool, job, send))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+async def run(pool, job, send):
+    '''Runs one job in the pool and send()s its status and result.'''
+    unknown = sorted(set(job) - set(JOB_DEFAULTS) - {"lm", "lu", "lp"})
+    job = dict(JOB_DEFAULTS, **job)
+    send({"id": job["id"], "status": "queued"})
+    start = time.perf_counter()
+    try:
+        if unknown:
+            raise ValueError("unknown {}".format(", ".join(unknown)))
+        for name in ["lm", "lu", "lp"]:
+            if name not in job:
+                raise ValueError("missing {}".format(name))
+        result = await pool.run(run_job, job)
+    except Exception as e:
+        send({"id": job["id"], "status": "error", "error": "{}: {}".format(type(e).__name__, e)})
+        return
+    send(dict({"id": job["id"], "status": "done", "seconds": time.perf_counter() - start}, **result))
+
+# the datasets loaded by a (worker) process, least recently used first, and
+# the args of the service
+datasets = collections.OrderedDict()
+worker_args = {}
+
+def worker_init(a):
+    worker_args.update(a)
+    # the library prints its progress, which must not end up among the answers
+    sys.stdout = sys.stderr
+
+def run_job(job):
+    '''Simulates and computes the metrics of a job, in a worker process.
+
+    Without a seed, one is drawn and returned with the result so that the
+    job can be replayed, and like in sim.py the cache is not used, since
+    nothing would ever ask for that seed again.
+    '''
+    labels_mon, labels_unmon, pred_mon, pred_unmon = load_dataset(job["lm"], job["lu"], job["lp"])
+    seed = job["seed"]
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    cache = None
+    if worker_args["cache"] is not None and job["seed"] is not None:
+        cache = worker_args["cache"], int(worker_args["cache_size"]*1024*1024)
+    levels = evaluate(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                int(job["t"]), float(job["p"]), float(job["f"]), float(job["c"]),
+                int(job["a"]), bool(job["z"]), 1, seed, job["m"] == "analytic",
+                int(job["th"]), cache)
+    if levels == -1:
+        raise ValueError("no simulation for these predictions")
+    threshold = levels[0]["thresholds"]
+
+    wf_curve = None
+    if job["wf"] is not None:
+        _, _, wf_mon, wf_unmon = load_dataset(job["lm"], job["lu"], job["wf"])
+        wf_curve = metrics_curves(threshold, [(summarize(wf_mon), summarize(wf_unmon))], labels_mon, labels_unmon)[0]
+
+    if job["o"] is not None and len(threshold) > 1:
+        save_figure(job, levels, wf_curve)
+
+    return {"seed": seed,
+            "levels": [dict(curve_json(level["curve"]), thresholds=level["thresholds"].tolist(),
+                            popularity=level["popularity"], mon_counter=int(level["mon_counter"]),
+                            unmon_counter=int(level["unmon_counter"])) for level in levels],
+            "wf": None if wf_curve is None else dict(curve_json(wf_curve), thresholds=threshold.tolist())}
+
+def load_dataset(lm, lu, lp):
+    '''Returns the labels and predictions in the files lm, lu, and lp, from
+    memory if loaded before by this process and not changed since. Datasets
+    are checked with check_datatypes() when loaded.'''
+    key = tuple((f, os.stat(f).st_mtime_ns) for f in [lm, lu, lp])
+    if key in datasets:
+        datasets.move_to_end(key)
+        return datasets[key]
+
+    labels_mon, labels_unmon = load_array(lm), load_array(lu)
+    pred_mon, pred_unmon = load_predictions(lp, len(labels_mon))
+    if not check_datatypes(labels_mon, labels_unmon, pred_mon, pred_unmon):
+        raise ValueError("labels and predictions failed check_datatypes(), see stderr")
+    datasets[key] = labels_mon, labels_unmon, pred_mon, pred_unmon
+    while len(datasets) > worker_args["datasets"]:
+        datasets.popitem(last=False)
+    return datasets[key]
+
+def curve_json(curve):
+    '''Returns a metrics_curve() as a dict of lists, for JSON.'''
+    names = ["tp", "fpp", "fnp", "tn", "fn", "accuracy", "recall", "precision"]
+    return {name: np.asarray(values).tolist() for name, values in zip(names, curve)}
+
+def save_figure(job, levels, wf_curve):
+    '''Saves the precision-recall figure of a job to o.pdf, like metrics.py.'''
+    import matplotlib.pyplot as plt # only needed for the figure
+    plot.legends[0] = job["wl"]
+    fig, ax = plot.figure(job["d"])
+    if wf_curve is not None:
+        plot.plot_curve(ax, wf_curve, 0)
+    for i, level in enumerate(levels):
+        plot.plot_curve(ax, level["curve"], 1+i)
+    plot.save(ax, "{}.pdf".format(job["o"]))
+    plt.close(fig)
+
+if __name__ == "__main__":
+    args = vars(ap.parse_args())
+    main()
@@ -0,0 +1,21 @@
+'''Simulating Website Fingerprinting with Website Oracles (WF+WO) attacks.
+
+The library behind sim.py and metrics.py, for simulating and computing metrics
+in-process on lists or NumPy arrays, e.g.:
+
+    import wfwo
+    levels = wfwo.evaluate(labels_mon, labels_unmon, pred_mon, pred_unmon, timeframe=100)
+
+See the modules for the details: sim for simulations, oracle for the simulated
+website oracle, metrics for metrics, data for loading and saving, plot for
+figures (the only module that uses matplotlib), profiling for --profile, and
+cache for --cache.
+metrics() is wfwo.metrics.metrics(), as wfwo.metrics is its module.
+'''
+from .data import (check_datatypes, load_array, load_compact, load_predictions,
+    load_repetitions, load_results, save_compact, summarize)
+from .metrics import (curve_band, curve_point, label_lookup, metrics_curve,
+    metrics_curves, simple_metrics, thresholds)
+from .oracle import create_oracle
+from .sim import (evaluate, sim_wf_wo, sim_wf_wo_repeat, sim_wf_wo_stream,
+    sim_wf_wo_sweep, wf_wo_list_prob, wf_wo_single)
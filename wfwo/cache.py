@@ -0,0 +1,100 @@
+'''A content-addressed cache of simulated popularity levels and their metrics.
+
+Each entry is a pickle file named by the key() of everything its value depends
+on, so changing any input or parameter misses the cache instead of returning
+something stale. Entries are in a directory of up to max_bytes, evicting the
+least recently used entries first, where a hit counts as a use.
+'''
+import hashlib
+import numpy as np
+import os
+import pickle
+import tempfile
+
+# bump when a change to the simulation or metrics changes their results for
+# the same inputs and parameters, so that older entries are never used
+VERSION = 1
+
+# rows of an array hashed at a time, to bound the memory used for hashing
+# memory-mapped arrays
+HASH_ROWS = 1 << 16
+
+def digest(*values):
+    '''Returns a hex SHA-256 of values: arrays and lists by the contents, type,
+    and shape of them as an array, and anything else by its repr().
+
+    Lists, e.g., of rows of probabilities, are converted to arrays HASH_ROWS
+    rows at a time rather than all at once, so hashing them never holds a
+    copy of the whole list as an array. A list hashes the same as the array
+    of it.
+    '''
+    h = hashlib.sha256(str(VERSION).encode())
+    for value in values:
+        if isinstance(value, (list, np.ndarray)):
+            shape = (len(value),) + (np.shape(value[0]) if len(value) else ())
+            h.update("{}".format(shape).encode())
+            for start in range(0, len(value), HASH_ROWS):
+                rows = np.ascontiguousarray(value[start:start+HASH_ROWS])
+                h.update(str(rows.dtype).encode())
+                h.update(rows.tobytes())
+        else:
+            h.update(repr(value).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def digest_file(filename):
+    '''Returns a hex SHA-256 of the contents of a file.'''
+    h = hashlib.sha256()
+    with open(filename, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def path(directory, key):
+    return os.path.join(directory, key[:2], key + ".pkl")
+
+def load(directory, key):
+    '''Returns the value stored for key, or None if it is not in the cache.'''
+    filename = path(directory, key)
+    try:
+        with open(filename, "rb") as handle:
+            value = pickle.load(handle)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    os.utime(filename) # used, so evicted last
+    return value
+
+def store(directory, key, value, max_bytes):
+    '''Stores value for key, then evicts entries until at most max_bytes.
+
+    The entry is written to a temporary file and then renamed, so concurrent
+    runs sharing a directory never read a partial entry.
+    '''
+    filename = path(directory, key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) as handle:
+        pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(handle.name, filename)
+    evict(directory, max_bytes)
+
+def evict(directory, max_bytes):
+    '''Deletes the least recently used entries until the cache is at most
+    max_bytes.'''
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError: # evicted by another run
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    total = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,154 @@
+'''Loading and saving labels, WF predictions, and simulated WF+WO predictions.'''
+import numpy as np
+import pickle
+
+def load_array(filename):
+    '''Loads a pickled list as an array, or memory-maps a .npy file.
+
+    A memory-mapped array is read-only and only read from disk as it is used,
+    so large files load instantly and without a copy. Use convert.py to convert
+    pickles to .npy files.
+    '''
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode="r")
+    with open(filename, 'rb') as handle:
+        return np.array(pickle.load(handle))
+
+def load_predictions(filename, num_mon):
+    '''Loads the monitored and unmonitored predictions of a WF attack.
+
+    Besides a pickled list of the monitored and unmonitored predictions, this
+    also reads a .npz file with the arrays "mon" and "unmon", or a .npy file with
+    the monitored predictions followed by the unmonitored ones, split after the
+    first num_mon. The .npy file is memory-mapped, see load_array(), while the
+    arrays of a .npz file are read into memory.
+    '''
+    if filename.endswith(".npz"):
+        with np.load(filename) as predictions:
+            return predictions["mon"], predictions["unmon"]
+    if filename.endswith(".npy"):
+        predictions = load_array(filename)
+        return predictions[:num_mon], predictions[num_mon:]
+    with open(filename, 'rb') as handle:
+        return pickle.load(handle)
+
+def load_results(filename):
+    '''Loads the simulated predictions saved by sim.py.
+
+    Returns, for each popularity level, the summarize()d monitored and
+    unmonitored predictions and the number of oracle calls for each, or a dict
+    from config to its popularity levels for a sweep. The predictions are
+    either pickled or in the compact .npz format, see load_compact().
+    '''
+    if filename.endswith(".npz"):
+        return load_compact(filename)
+    with open(filename, "rb") as handle:
+        results = pickle.load(handle)
+    if type(results) is dict: # sweep of configs
+        return {config: summarize_levels(levels) for config, levels in results.items()}
+    return summarize_levels(results)
+
+def load_compact(filename):
+    '''Loads the compact .npz output of save_compact() like load_results().'''
+    with np.load(filename) as npz:
+        f = {key: npz[key] for key in npz.files}
+    results = {}
+    has_prob = "mon_prob" in f
+    for c, (t, p, fpr, scale) in enumerate(f["configs"]):
+        results[(int(t), float(p), float(fpr), float(scale))] = [
+            [(f["mon_label"][c][i], f["mon_prob"][c][i] if has_prob else None),
+             (f["unmon_label"][c][i], f["unmon_prob"][c][i] if has_prob else None),
+             f["mon_counter"][c][i], f["unmon_counter"][c][i]]
+            for i in range(len(f["popularity"]))]
+    if len(results) == 1:
+        return list(results.values())[0]
+    return results
+
+def save_compact(filename, results):
+    '''Saves the results of sim_wf_wo_sweep(..., compact=True) in a .npz file.
+
+    This is all metrics.py needs, and about K times smaller than pickling the
+    simulated predictions for K labels. For C configs, L popularity levels, and
+    N monitored or unmonitored test cases, the arrays are:
+    - configs (C, 4): timeframe, probability, fpr, and scale Tor,
+    - popularity (L,): the starting Alexa rank of each level,
+    - mon_counter and unmon_counter (C, L): the number of oracle calls,
+    - mon_label and unmon_label (C, L, N): the predicted labels, and
+    - mon_prob and unmon_prob (C, L, N): their probabilities, only present if
+      the predictions are probabilities.
+    '''
+    configs = list(results)
+    levels = len(results[configs[0]])
+    arrays = {"configs": np.array(configs, dtype=np.float64),
+              "popularity": np.array([pow(10,i) for i in range(0,levels)])}
+    for h, half in enumerate(["mon", "unmon"]):
+        arrays[half+"_counter"] = np.array([[r[2+h] for r in results[c]] for c in configs])
+        arrays[half+"_label"] = np.array([[r[h][0] for r in results[c]] for c in configs], dtype=np.int32)
+        if results[configs[0]][0][h][1] is not None:
+            arrays[half+"_prob"] = np.array([[r[h][1] for r in results[c]] for c in configs])
+    np.savez(filename, **arrays)
+
+def load_repetitions(filename):
+    '''Loads the output of sim.py with repetitions (-r), see sim_wf_wo_repeat(),
+    as a dict of arrays. Returns None for other files.'''
+    if not filename.endswith(".npz"):
+        return None
+    with np.load(filename) as npz:
+        if "recall" not in npz.files:
+            return None
+        return {key: npz[key] for key in npz.files}
+
+def summarize_levels(levels):
+    return [[summarize(mon), summarize(unmon), mon_counter, unmon_counter]
+            for mon, unmon, mon_counter, unmon_counter in levels]
+
+def summarize(predictions):
+    '''Returns the predicted label and its probability for each prediction.
+
+    All that metrics need. For single label predictions, the probability is
+    None.
+    '''
+    if pred_type_single_pred(predictions):
+        return np.asarray(predictions), None
+    predictions = np.asarray(predictions)
+    return np.argmax(predictions, axis=1), np.max(predictions, axis=1)
+
+def check_datatypes(labels_mon, labels_unmon, pred_mon, pred_unmon):
+    def is_expected_type(t, name, ):
+        if not isinstance(t, (list, np.ndarray)):
+            print("{} is type {}, expect {}".format(name, type(t), [list, np.ndarray]))
+            return False
+        return True
+    
+    if not is_expected_type(labels_mon, "labels_mon"):
+        return False
+    if not is_expected_type(labels_unmon, "labels_unmon"):
+        return False
+    if not is_expected_type(pred_mon, "pred_mon"):
+        return False
+    if not is_expected_type(pred_unmon, "pred_unmon"):
+        return False
+
+    if len(labels_mon) != len(pred_mon):
+        print("expected the same number of monitored labels as predictions")
+        return False
+    if len(labels_unmon) != len(pred_unmon):
+        print("expected the same number of unmonitored labels as predictions")
+        return False
+
+    if not (pred_type_single_pred(pred_mon) or pred_type_list_of_prob(pred_mon)):
+        print("non-supported format for monitored predictions")
+        return False
+    if not (pred_type_single_pred(pred_unmon) or pred_type_list_of_prob(pred_unmon)):
+        print("non-supported format for unmonitored predictions")
+        return False
+
+    return True
+
+def pred_type_single_pred(pred):
+    '''Checks if each prediction is just a single integer.'''
+    return isinstance(pred[0], (int, np.integer))
+
+def pred_type_list_of_prob(pred):
+    '''Checks if each prediction is a list of floats for common types.'''
+    return isinstance(pred[0], (list, np.ndarray)) and isinstance(pred[0][0], (float, np.floating))
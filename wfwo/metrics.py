@@ -0,0 +1,187 @@
+'''Metrics of WF and WF+WO attacks, for one or many thresholds.'''
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+
+from . import profiling
+from .data import summarize
+
+def thresholds(n=16):
+    '''Returns n thresholds from 0, increasingly dense towards 1.'''
+    return np.append([0], 1.0 - 1 / np.logspace(0.05, 2, num=n-1, endpoint=True))
+
+def label_lookup(labels):
+    '''Returns a boolean array indexed by label, True for each label in labels.
+
+    Compute this once per label file and pass it to metrics_curve() and
+    simple_metrics(), instead of searching the labels for every prediction.
+    '''
+    labels = np.asarray(labels)
+    lookup = np.zeros(labels.max()+1, dtype=bool)
+    lookup[labels] = True
+    return lookup
+
+def in_lookup(lookup, label_pred):
+    '''Checks each predicted label against a lookup from label_lookup().'''
+    label_pred = np.asarray(label_pred)
+    inside = (label_pred >= 0) & (label_pred < len(lookup))
+    return inside & lookup[np.where(inside, label_pred, 0)]
+
+def metrics(threshold, predictions_mon, labels_mon, predictions_unmon, labels_unmon,
+            lookup_mon=None, lookup_unmon=None):
+    ''' Computes a range of metrics.
+
+    For details on the metrics, see, e.g., https://www.cs.kau.se/pulls/hot/baserate/
+    '''
+    curve = metrics_curve([threshold], summarize(predictions_mon), labels_mon, summarize(predictions_unmon), labels_unmon, lookup_mon, lookup_unmon)
+    return curve_point(curve)
+
+def metrics_curve(thresholds, summary_mon, labels_mon, summary_unmon, labels_unmon,
+                    lookup_mon=None, lookup_unmon=None):
+    ''' Computes metrics() for many thresholds at once.
+
+    Takes the output of summarize() for the monitored and unmonitored
+    predictions. Returns the same metrics as metrics(), but each as an array
+    with one value per threshold. Each group of predictions below is sorted by
+    probability once, so that counting the predictions at or above every
+    threshold is a single searchsorted(). The lookups from label_lookup() are
+    computed here if not given. Raises ValueError if an unmonitored test case
+    is confidently predicted as a label that is not a monitored one, which
+    means the labels are wrong.
+    '''
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    labels_mon, labels_unmon = np.asarray(labels_mon), np.asarray(labels_unmon)
+    if lookup_mon is None:
+        lookup_mon = label_lookup(labels_mon)
+    if lookup_unmon is None:
+        lookup_unmon = label_lookup(labels_unmon)
+    label_mon, prob_mon = summary_mon
+    label_unmon, prob_unmon = summary_unmon
+
+    def count_confident(prob):
+        '''Number of probabilities >= each threshold.'''
+        prob = np.sort(np.asarray(prob, dtype=np.float64))
+        return len(prob) - np.searchsorted(prob, thresholds, side="left")
+
+    # monitored: either confident and correct, confident and wrong monitored
+    # label, or simply wrong because not confident or predicted unmonitored
+    # for monitored
+    correct = label_mon == labels_mon
+    wrong_mon = ~correct & in_lookup(lookup_mon, label_mon)
+    tp = count_confident(prob_mon[correct])
+    fpp = count_confident(prob_mon[wrong_mon])
+    fn = len(label_mon) - tp - fpp
+
+    # unmonitored: correct prediction if not confident or predicted
+    # unmonitored, otherwise confident and predicted monitored for unmonitored
+    wrong = ~in_lookup(lookup_unmon, label_unmon)
+    invalid = wrong & (label_unmon >= labels_unmon[0])
+    if invalid.any() and count_confident(prob_unmon[invalid]).any(): # this should never happen
+        raise ValueError("this should never happen, wrongly labelled data? got label %d" % (label_unmon[invalid][0]))
+    fnp = count_confident(prob_unmon[wrong])
+    tn = len(label_unmon) - fnp
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        recall = np.where(tp + fn + fpp > 0, tp / (tp + fn + fpp), 0.0)
+        precision = np.where(tp + fpp + fnp > 0, tp / (tp + fpp + fnp), 0.0)
+    accuracy = (tp + tn) / (tp + fpp + fnp + fn + tn)
+
+    return tp, fpp, fnp, tn, fn, accuracy, recall, precision
+
+def simple_metrics(predictions_mon, labels_mon, predictions_unmon, labels_unmon,
+                    lookup_mon=None, lookup_unmon=None):
+    ''' Computes a range of metrics, but without support for a threshold. 
+
+    For details on the metrics, see, e.g.,
+    https://www.cs.kau.se/pulls/hot/baserate/ . This function is as close as
+    possible to metrics() for sake of ease of comparison: a single label is
+    the same as a probability of 1 for that label with threshold 0.
+    '''
+    predictions_mon, predictions_unmon = np.asarray(predictions_mon), np.asarray(predictions_unmon)
+    curve = metrics_curve([0], (predictions_mon, np.ones(len(predictions_mon))), labels_mon,
+                            (predictions_unmon, np.ones(len(predictions_unmon))), labels_unmon,
+                            lookup_mon, lookup_unmon)
+    return curve_point(curve)
+
+def curve_point(curve, i=0):
+    '''Returns the metrics of metrics_curve() at its i-th threshold, as
+    metrics() returns them.'''
+    tp, fpp, fnp, tn, fn, accuracy, recall, precision = [c[i] for c in curve]
+    return int(tp), int(fpp), int(fnp), int(tn), int(fn), float(accuracy), float(recall), float(precision)
+
+def metrics_curves(thresholds, summaries, labels_mon, labels_unmon, jobs=1, ranks=None):
+    '''Returns metrics_curve() for each (summary_mon, summary_unmon) pair in
+    summaries, e.g., the popularity levels of load_results(). Single labels (a
+    probability of None) count as a probability of 1, as in simple_metrics().
+
+    With jobs > 1, the curves are computed by a pool of processes. The
+    summaries and labels are then written once to .npy files in a temporary
+    directory that the workers memory-map, so they share the same pages instead
+    of each task pickling its arrays. Either way, the curves are the same. If
+    given, ranks are recorded with the profile of each curve.
+    '''
+    data = {"thresholds": np.asarray(thresholds), "summaries": summaries,
+            "labels": [labels_mon, labels_unmon], "ranks": ranks or [None]*len(summaries),
+            "profile": profiling.tracing()}
+    if jobs <= 1 or len(summaries) <= 1:
+        data = metrics_worker_data(data)
+        done = [metrics_worker(i, data) for i in range(len(summaries))]
+    else:
+        with tempfile.TemporaryDirectory() as shared:
+            def share(name, values):
+                if values is None:
+                    return None
+                filename = os.path.join(shared, name + ".npy")
+                np.save(filename, np.asarray(values))
+                return filename
+            data["labels"] = [share("mon", labels_mon), share("unmon", labels_unmon)]
+            data["summaries"] = [[(share("{}_{}_label".format(i, h), label), share("{}_{}_prob".format(i, h), prob))
+                                  for h, (label, prob) in enumerate(pair)] for i, pair in enumerate(summaries)]
+            data["shared"] = True
+            with multiprocessing.Pool(jobs, metrics_worker_init, (data,)) as pool:
+                done = pool.map(metrics_worker, range(len(summaries)))
+
+    curves = []
+    for curve, profile in done:
+        profiling.add(profile)
+        curves.append(curve)
+    return curves
+
+# the thresholds, summaries, and labels for metrics_curves(), passed once per
+# worker process rather than once per task
+worker_data = {}
+
+def metrics_worker_init(data):
+    worker_data.update(metrics_worker_data(data))
+    if data["profile"]:
+        profiling.start()
+
+def metrics_worker_data(data):
+    '''Returns data for metrics_worker(), with the shared arrays memory-mapped
+    and the label_lookup()s of the labels.'''
+    data = dict(data)
+    if data.get("shared"):
+        def load(filename):
+            return None if filename is None else np.load(filename, mmap_mode="r")
+        data["labels"] = [load(filename) for filename in data["labels"]]
+        data["summaries"] = [[(load(label), load(prob)) for label, prob in pair]
+                             for pair in data["summaries"]]
+    data["lookups"] = [label_lookup(labels) for labels in data["labels"]]
+    return data
+
+def metrics_worker(i, data=None):
+    '''Computes the curve of the i-th summaries of metrics_curves(), with
+    data from metrics_worker_data(), or worker_data if None. Returns it with
+    its profile for profiling.add().'''
+    d = worker_data if data is None else data
+    with profiling.measure(stage="metrics", rank=d["ranks"][i], thresholds=len(d["thresholds"])) as profile:
+        summaries = [(label, np.ones(len(label)) if prob is None else prob) for label, prob in d["summaries"][i]]
+        curve = metrics_curve(d["thresholds"], summaries[0], d["labels"][0], summaries[1], d["labels"][1], *d["lookups"])
+    return curve, profile
+
+def curve_band(values, ci=95):
+    '''Returns the mean and the ci percent interval over repetitions (the first
+    axis) of values.'''
+    low, high = np.percentile(values, [(100-ci)/2, 100-(100-ci)/2], axis=0)
+    return np.mean(values, axis=0), low, high
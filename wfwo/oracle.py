@@ -0,0 +1,232 @@
+'''The simulated website oracle and the simulated visits over Tor it is based on.'''
+import math
+import numpy as np
+
+def create_oracle(timeframe, popularity, 
+                    probability=1.0, fpr=0.0, lazy=True, scale=1,
+                    rng=None, rng_tor=None, analytic=False):
+    # all random draws of the oracle come from rng, except for the lazily
+    # simulated Tor network below which comes from rng_tor, if set, such that
+    # two oracles can share the network but not their draws
+    if rng is None:
+        rng = np.random.default_rng()
+    if rng_tor is None:
+        rng_tor = rng
+
+    # helper function that sims visits over Tor
+    def sim_visits(rng):
+        return pop_mani_wilsonbrown_et_al_batch(
+            tor_network_sim_num_sites(timeframe, scale), rng)
+
+    # if analytic, whether another Tor user visited a website is drawn directly
+    # with the probability that it is among the visits in the timeframe, which
+    # is the same as a fresh simulation for each call but without simulating
+    # the Tor network at all (so lazy does not matter)
+    if analytic:
+        num_visits = tor_network_sim_num_sites(timeframe, scale)
+        def visited_by_others(websites):
+            p = pop_mani_wilsonbrown_et_al_visited(websites + popularity, num_visits)
+            return rng.random(np.shape(p)) < p
+    else:
+        # simulated visited websites over Tor by all other Tor users, as a
+        # bitmap over all websites for O(1) lookups
+        visited = visited_bitmap(sim_visits(rng_tor))
+
+    # whether to make a fresh simulation of the Tor network for each call, see
+    # oracle() below
+    fresh = not lazy or popularity < 1000 or timeframe > 1000
+    
+    # hack to pass a mutable value that allows us to track the number of calls
+    # to the oracle, followed by the number of answers by outcome and the
+    # number of calls to oracle.batch(), see ORACLE_COUNTS
+    counter = [0] * len(ORACLE_COUNTS)
+
+    def oracle(website, correct):
+        '''Precondition: correct is the correct label for a _monitored_ website.
+
+        We have three cases:
+        - the target user visited the correct monitored website, and then, per
+          definition, the the oracle detects it with the defined probability, 
+        - the website oracle produced a false positive, or
+        - the website was visited by another (simulated) Tor user.
+
+        Below we only make a fresh simulation of the Tor network if told to (not
+        lazy), the simulated starting Alexa rank is below 1k, or the timeframe is long enough to warrant it (statistically). 
+        If analytic, no simulation is needed, see above.
+
+        Use oracle.batch() to ask about many websites at once.
+        '''
+        counter[0] = counter[0] + 1
+
+        if website == correct and rng.random() < probability: # observed
+            counter[1] = counter[1] + 1
+            return True
+        elif rng.random() < fpr: # false positive
+            counter[2] = counter[2] + 1
+            return True
+        elif analytic: # exact probability
+            answer = bool(visited_by_others(website))
+        elif fresh: # be not lazy
+            answer = website + popularity in sim_visits(rng)
+        else:
+            answer = bool(in_visited(visited, website + popularity)) # be lazy
+        counter[3 if answer else 4] = counter[3 if answer else 4] + 1
+        return answer
+
+    def oracle_batch(websites, correct):
+        '''Same as oracle(), but for arrays of websites and correct labels.
+
+        Returns a boolean array with the answer for each pair, and counts each
+        pair as one call. The random draws are made for all pairs up front,
+        which gives the same distribution as calling oracle() once per pair.
+        '''
+        websites, correct = np.asarray(websites), np.asarray(correct)
+        counter[0] = counter[0] + len(websites)
+
+        observed = (websites == correct) & (rng.random(len(websites)) < probability)
+        answer = observed | (rng.random(len(websites)) < fpr)
+        detected = answer.copy()
+        if analytic:
+            answer |= visited_by_others(websites)
+        elif fresh:
+            for i in np.flatnonzero(~answer):
+                answer[i] = websites[i] + popularity in sim_visits(rng)
+        else:
+            answer |= in_visited(visited, websites + popularity)
+
+        num_observed, num_detected, num_answer = [int(np.count_nonzero(a)) for a in [observed, detected, answer]]
+        counter[1] = counter[1] + num_observed
+        counter[2] = counter[2] + num_detected - num_observed
+        counter[3] = counter[3] + num_answer - num_detected
+        counter[4] = counter[4] + len(websites) - num_answer
+        counter[5] = counter[5] + 1
+        return answer
+
+    oracle.batch = oracle_batch
+    return oracle, counter
+
+# what each value of the counter of create_oracle() counts: all calls, calls
+# answered because the oracle observed the visit, because of a false positive,
+# and because another Tor user visited the website, calls answered with not
+# visited, and calls to oracle.batch() (the rounds of wf_wo_list_prob())
+ORACLE_COUNTS = ["calls", "observed", "false_positive", "visited", "rejected", "batches"]
+
+def oracle_totals(stages):
+    '''Sums the oracle counts of all profiled stages from sim_worker().'''
+    totals = dict.fromkeys(ORACLE_COUNTS, 0)
+    for stage in stages:
+        for key, value in stage.get("oracle", {}).items():
+            totals[key] += value
+    return totals
+
+def pop_mani_wilsonbrown_et_al(rng=None):
+    """Returns a random website visit, drawn with rng (a NumPy Generator).
+
+    This is an approximation of the observed distribution by Mani and
+    Wilson-Brown et al. in "Understanding Tor Usage with Privacy-Preserving
+    Measurement", Figure 2. The approximation is naive but punishes our attacker
+    as long as we monitor websites in Alexa top 1m. This is because we slightly
+    overestimate the visits to Alexa top 1m.
+    """
+
+    """
+    Constant for torproject.org, because it was overrepresented in the paper due
+    to what might have been a bug in Onionoo. We give it a constant label such
+    that we can account for the case if the attacker is monitoring
+    torproject.org or not.
+    """
+    torproject_label = 100000-1
+    if rng is None:
+        rng = np.random.default_rng()
+
+    x = rng.random() # uniform [0,1), slight bias towards Alexa sites
+    if x < 0.401:
+        return torproject_label
+    elif x < 0.401+0.084: # websites (0,10]
+        return rng.integers(0, 10)+1
+    elif x < 0.401+0.084+0.051: # websites (10,100]
+        return rng.integers(10,100)+1
+    elif x < 0.401+0.084+0.051+0.062: # websites (100,1k]
+        return rng.integers(100,1000)+1
+    elif x < 0.401+0.084+0.051+0.062+0.043: # websites (1k,10k]
+        return rng.integers(1000, 10*1000)+1
+    elif x < 0.401+0.084+0.051+0.062+0.043+0.077: # websites (10k,100k]
+        return rng.integers(10*1000, 100*1000)+1
+    elif x < 0.401+0.084+0.051+0.062+0.043+0.077+0.07: # websites (100k,1m]
+        return rng.integers(100*1000, 1000*1000)+1
+    else:
+        return rng.integers(1000*1000, 2*1000*1000)+1
+
+"""
+The buckets of pop_mani_wilsonbrown_et_al() as a table: the cumulative
+probability of each bucket (summed in the same order as the if/elif chain, so
+the floats are identical) and the range [low, high) that a uniform integer is
+drawn from before adding 1. The first bucket is the constant torproject.org
+label, expressed as a range of width one.
+"""
+POP_BUCKET_CDF = np.cumsum([0.401, 0.084, 0.051, 0.062, 0.043, 0.077, 0.07])
+
+POP_BUCKET_LOW = np.array([100000-2, 0, 10, 100, 1000, 10*1000, 100*1000,
+                            1000*1000])
+
+POP_BUCKET_HIGH = np.array([100000-1, 10, 100, 1000, 10*1000, 100*1000,
+                            1000*1000, 2*1000*1000])
+
+def pop_mani_wilsonbrown_et_al_batch(n, rng=None):
+    """Returns n random website visits as an integer array, drawn with rng.
+
+    Same distribution as pop_mani_wilsonbrown_et_al(), but draws all visits at
+    once: one uniform draw picks the bucket of each visit and a second draws
+    the website uniformly within its bucket.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    bucket = np.searchsorted(POP_BUCKET_CDF, rng.random(n), side="right")
+    return rng.integers(POP_BUCKET_LOW[bucket], POP_BUCKET_HIGH[bucket]) + 1
+
+# the probability of each bucket of pop_mani_wilsonbrown_et_al(), the last one
+# taking what is left
+POP_BUCKET_P = np.diff(np.concatenate([[0.0], POP_BUCKET_CDF, [1.0]]))
+
+def pop_mani_wilsonbrown_et_al_prob(websites):
+    """Returns the probability that a visit by pop_mani_wilsonbrown_et_al() is
+    to each website, 0 for websites it never returns.
+
+    A website gets the probability of each bucket it is in, spread uniformly
+    over the bucket, so torproject.org also gets its share of (10k,100k].
+    """
+    websites = np.asarray(websites)
+    prob = np.zeros(websites.shape)
+    for p, low, high in zip(POP_BUCKET_P, POP_BUCKET_LOW, POP_BUCKET_HIGH):
+        prob += np.where((websites > low) & (websites <= high), p/(high-low), 0.0)
+    return prob
+
+def pop_mani_wilsonbrown_et_al_visited(websites, n):
+    """Returns the probability that each website is among n visits drawn with
+    pop_mani_wilsonbrown_et_al(), i.e., 1-(1-P(website))^n.
+    """
+    return -np.expm1(n*np.log1p(-pop_mani_wilsonbrown_et_al_prob(websites)))
+
+def visited_bitmap(visits):
+    """Returns a boolean array indexed by website, True for visited websites."""
+    bitmap = np.zeros(POP_BUCKET_HIGH.max()+1, dtype=bool)
+    bitmap[visits] = True
+    return bitmap
+
+def in_visited(bitmap, websites):
+    """Looks up one or more websites in a bitmap from visited_bitmap().
+
+    Websites outside of the bitmap (beyond 2M) are never visited.
+    """
+    websites = np.asarray(websites)
+    inside = (websites >= 0) & (websites < len(bitmap))
+    return inside & bitmap[np.where(inside, websites, 0)]
+
+def tor_network_sim_num_sites(ms,scale_tor_network=1):
+    """Answers: "how many new websites are visited over Tor in x ms?.
+
+    This is based on 140M websites/24h by Mani et al.., the upper bound if a
+    95% confidence interval for inferred website visits in early 2018 for the
+    entire Tor network. 
+    """
+    return int(math.ceil((float(140*1000*1000)/float(24*60*60*1000))*ms*scale_tor_network))
@@ -0,0 +1,63 @@
+'''Precision-recall figures of metrics.
+
+matplotlib is only imported by the functions that draw, so that computing
+metrics without a figure does not pay for importing it.
+'''
+
+# values for styling graphs, the first legend is for the WF attack and the rest
+# for each popularity level
+linestyles = [":", "--", "-.", "-", "-.", "-", ":", "--"]
+markerstyles = ['o', 's', 'v', '^', '<', '>', '*', 's', 'p', '*', 'h', 'H', 'D', 'd']
+legends = ['WF', '1', '10', '100', '1k', '10k', '100k']
+colors = ['#d44f7e', '#ffd03d', '#2fb651', '#fb8134', '#7556a2', '#5bb2e5']
+
+def figure(title=None):
+    '''Returns a new styled figure and its axes for plot_curve() and
+    plot_band().'''
+    import matplotlib.pyplot as plt
+    plotstyle(title) # intended, due to matplotlib shenanigans
+    fig, ax = plt.subplots()
+    fig.set_size_inches(5,3)
+    plotstyle(title) # intended, due to matplotlib shenanigans
+    return fig, ax
+
+def save(ax, filename):
+    '''Adds the legend to the figure of ax and saves it as filename.'''
+    import matplotlib.pyplot as plt
+    ax.legend(facecolor='#f7f7f7', ncol=2)
+    plt.savefig(filename, bbox_inches='tight')
+
+def plot_curve(ax, curve, i):
+    '''Plots the precision-recall curve of metrics_curve() with style i.'''
+    tp, fpp, fnp, tn, fn, accuracy, recall, precision = curve
+    ax.plot(recall, precision, label=legends[i], ls=linestyles[i], marker=markerstyles[i], color=colors[i], markevery=max(1, len(recall) // 15))
+
+def plot_band(ax, band_recall, band_precision, i):
+    '''Plots the mean precision-recall curve of curve_band()s with style i, and
+    the interval of the precision as a band around it.'''
+    recall, precision = band_recall[0], band_precision[0]
+    ax.plot(recall, precision, label=legends[i], ls=linestyles[i], marker=markerstyles[i], color=colors[i], markevery=max(1, len(recall) // 15))
+    ax.fill_between(recall, band_precision[1], band_precision[2], color=colors[i], alpha=0.2, lw=0)
+
+def plotstyle(title=None):
+    '''Sets a number of parameters for our graphs away from main()'''
+    import matplotlib.pyplot as plt
+    plt.style.use('ggplot')
+    
+    # uncomment below if you need TrueType Type 1 complaint fonts (looks a bit ugly)
+    #plt.rcParams['pdf.fonttype'] = 42
+    #plt.rcParams['ps.fonttype'] = 42
+
+    plt.rcParams['lines.linewidth'] = 2
+    plt.rcParams['font.size'] = 12
+    plt.rcParams['xtick.labelsize'] = 12
+    plt.rcParams['ytick.labelsize'] = 12
+    plt.rcParams['legend.fontsize'] = 12
+    plt.rcParams['axes.labelsize'] = 14
+    plt.rcParams['axes.titlesize'] = 14
+    plt.rcParams['axes.facecolor'] = '#fbfbfb'
+    plt.xlabel('Recall', color=[0, 0, 0, 1])
+    plt.ylabel('Precision', color=[0, 0, 0, 1])
+    if title is not None:
+        plt.title(title)
+    plt.tight_layout()
@@ -0,0 +1,86 @@
+'''Time and memory of each stage of sim.py and metrics.py, see --profile.
+
+Call start() to trace memory allocations (with tracemalloc, which also sees
+NumPy arrays), wrap each stage in stage(), and write the report with save().
+Without start(), stages are only timed and not recorded, so that using the
+library without a report does not collect stages.
+'''
+import contextlib
+import json
+import time
+import tracemalloc
+
+# the recorded stages, in the order they finished
+stages = []
+
+# whether start() was called, see tracing()
+started = False
+
+# the peak memory seen so far by each measure() in progress, innermost last
+peaks = []
+
+def start():
+    '''Starts recording stages and tracing memory allocations, if not
+    already started.'''
+    global started
+    started = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def tracing():
+    '''Returns if stages are recorded, for passing on to other processes.'''
+    return started
+
+@contextlib.contextmanager
+def measure(**info):
+    '''Measures the wall time and peak memory of the with block.
+
+    Yields a dict with info, where the with block can add more, that gets
+    "seconds" and "peak_bytes" (None if not tracing) on exit. Measures can be
+    nested: the peak of an inner measure also counts for the outer ones.
+    '''
+    entry = dict(info)
+    if tracemalloc.is_tracing():
+        if peaks:
+            peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    peaks.append(0)
+    start = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["seconds"] = time.perf_counter() - start
+        peak = peaks.pop()
+        entry["peak_bytes"] = None
+        if tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            entry["peak_bytes"] = peak
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+
+@contextlib.contextmanager
+def stage(name, **info):
+    '''Like measure(), but records the stage for the report if started.'''
+    with measure(stage=name, **info) as entry:
+        yield entry
+    add(entry)
+
+def add(entry):
+    '''Records a stage measured elsewhere, e.g., by another process, if
+    started.'''
+    if started:
+        stages.append(entry)
+
+def save(filename, **extra):
+    '''Writes the recorded stages, and any extra values, as JSON.'''
+    report = dict(extra)
+    report["stages"] = stages
+    with open(filename, "w") as handle:
+        json.dump(report, handle, indent=2, default=json_default)
+
+def json_default(value):
+    # NumPy scalars, e.g., counts
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError("can't write {} as JSON".format(type(value)))
@@ -0,0 +1,450 @@
+'''Simulation of WF+WO attacks from the predictions of a WF attack.'''
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+
+from . import cache as level_cache
+from . import metrics
+from . import profiling
+from .data import pred_type_list_of_prob, pred_type_single_pred, summarize
+from .oracle import ORACLE_COUNTS, create_oracle
+
+def sim_wf_wo(labels_mon, labels_unmon, # correct labels
+                pred_mon, pred_unmon,   # predictions from WF attack
+                timeframe=100,          # in ms, timeframe for WO
+                probability=1.0,        # probability of WO observing
+                fpr=0.0,                # false positive rate of WO
+                scale_tor=1.0,          # scale the size of Tor network
+                max_alexa=4,            # Alexa 10^{0,max_alexa} (inclusive)
+                lazy=True,              # sim WO lazy or every classification
+                jobs=1,                 # number of processes to use
+                seed=None,              # seed for random draws, None for fresh
+                analytic=False,         # draw visits by others analytically
+                cache=None):            # (directory, max bytes) to cache levels
+    config = (timeframe, probability, fpr, scale_tor)
+    results = sim_wf_wo_sweep(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                [config], max_alexa, lazy, jobs, seed, analytic=analytic, cache=cache)
+    if results == -1:
+        return -1
+    return results[config]
+
+def evaluate(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                timeframe=100, probability=1.0, fpr=0.0, scale_tor=1.0,
+                max_alexa=4, lazy=True, jobs=1, seed=None, analytic=False,
+                num_thresholds=16, cache=None):
+    '''Simulates WF+WO like sim_wf_wo() and computes the metrics of each
+    popularity level, like running sim.py and then metrics.py but in memory.
+
+    The labels and predictions are lists or NumPy arrays as described by
+    check_datatypes(). Returns a list with a dict for each popularity level:
+    its starting Alexa rank ("popularity"), the number of oracle calls
+    ("mon_counter" and "unmon_counter"), the thresholds ("thresholds", only 0
+    for single labels), and the metrics_curve() at them ("curve").
+
+    With a cache, see sim_wf_wo_sweep(), the metrics of each level are cached
+    as well, and if all levels are cached nothing is simulated.
+    '''
+    config = (timeframe, probability, fpr, scale_tor)
+    keys = []
+    if cache is not None and seed is not None:
+        inputs = level_cache.digest(labels_mon, labels_unmon, pred_mon, pred_unmon)
+        keys = [level_cache.digest("metrics", level_key(inputs, (config+(lazy, analytic), pow(10,i)), seed, True), num_thresholds)
+                for i in range(0,max_alexa+1)]
+        levels = [level_cache.load(cache[0], key) for key in keys]
+        if all(level is not None for level in levels):
+            return levels
+
+    results = sim_wf_wo_sweep(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                [config], max_alexa, lazy, jobs, seed, True, analytic=analytic, cache=cache)
+    if results == -1:
+        return -1
+
+    lookups = metrics.label_lookup(labels_mon), metrics.label_lookup(labels_unmon)
+    threshold = metrics.thresholds(num_thresholds) if pred_type_list_of_prob(pred_mon) else np.zeros(1)
+    levels = []
+    for i, (summary_mon, summary_unmon, mon_counter, unmon_counter) in enumerate(results[config]):
+        if summary_mon[1] is None: # a single label is a probability of 1 for that label
+            summary_mon = summary_mon[0], np.ones(len(summary_mon[0]))
+            summary_unmon = summary_unmon[0], np.ones(len(summary_unmon[0]))
+        levels.append({"popularity": pow(10,i), "mon_counter": mon_counter,
+            "unmon_counter": unmon_counter, "thresholds": threshold,
+            "curve": metrics.metrics_curve(threshold, summary_mon, labels_mon,
+                summary_unmon, labels_unmon, *lookups)})
+        if keys:
+            level_cache.store(cache[0], keys[i], levels[-1], cache[1])
+    return levels
+
+def sim_wf_wo_sweep(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                    configs,            # (timeframe, probability, fpr, scale_tor)
+                    max_alexa=4, lazy=True, jobs=1, seed=None, compact=False,
+                    stream=None, analytic=False, cache=None):
+    '''Simulates WF+WO for each config in a list, sharing the labels and
+    predictions between them.
+
+    Returns a dict from each config tuple to what sim_wf_wo() returns for it,
+    with duplicate configs only simulated once. The labels and predictions are shared by all tasks, see sim_data().
+
+    All random draws come from streams spawned from a SeedSequence of the seed,
+    see seed_streams(). The monitored and unmonitored predictions of each config
+    and popularity level are simulated as two separate tasks, either in this
+    process or with a pool of jobs processes, with the same result for the same
+    seed. Every config uses the same streams, so a config is simulated the same
+    in a sweep as on its own.
+
+    If compact, each simulated prediction is only kept as its summarize()d
+    label and probability, see save_compact(). For stream, see
+    sim_wf_wo_stream(). For analytic, see create_oracle().
+
+    If cache is a (directory, max bytes) tuple and there is a seed, each
+    simulated popularity level is stored in a cache in the directory, see
+    wfwo/cache.py, and levels simulated before with the same inputs and
+    parameters are loaded from it instead, see level_key(). Streams are never
+    cached.
+    '''
+    data = sim_data(labels_mon, labels_unmon, pred_mon, pred_unmon, compact, stream)
+    if data == -1:
+        return -1
+
+    configs = list(dict.fromkeys(configs))
+    popularity = [pow(10,i) for i in range(0,max_alexa+1)]
+    seed_seq = np.random.SeedSequence(seed)
+    print("seed for this simulation: {}".format(seed_seq.entropy))
+    streams = seed_streams(seed_seq, len(popularity))
+    tasks = []
+    for c, (timeframe, probability, fpr, scale_tor) in enumerate(configs):
+        print("simulating WF+WO with timeframe {} ms, probability {}, fpr = {}, lazy = {}, scale Tor = {}, analytic = {}".format(timeframe, probability, fpr, lazy, scale_tor, analytic))
+        tasks += sim_tasks((timeframe, probability, fpr, scale_tor, lazy, analytic), popularity, streams, c)
+
+    # the two tasks of each level start at an even index
+    keys, cached = {}, {}
+    if cache is not None and stream is None:
+        if seed is None:
+            print("\tnot using the cache, since there is no seed to replay")
+        else:
+            inputs = level_cache.digest(labels_mon, labels_unmon, pred_mon, pred_unmon)
+            for i in range(0, len(tasks), 2):
+                keys[i] = level_key(inputs, tasks[i], seed, compact)
+                level = level_cache.load(cache[0], keys[i])
+                if level is not None:
+                    cached[i] = level
+            print("\t{} of {} popularity levels loaded from the cache".format(len(cached), len(keys)))
+    run = [task for i in range(0, len(tasks), 2) if i not in cached for task in tasks[i:i+2]]
+
+    if jobs > 1:
+        print("\tsimulating {} configs of {} popularity levels with {} processes".format(len(configs), len(popularity), jobs))
+    done = iter(list(sim_run(data, run, jobs)))
+
+    results = {config: [] for config in configs}
+    for i in range(0, len(tasks), 2):
+        if i in cached:
+            level = cached[i]
+        else:
+            level = next(done), next(done)
+            if i in keys:
+                level_cache.store(cache[0], keys[i], level, cache[1])
+        (wo_pred_mon, wo_pred_mon_counter), (wo_pred_unmon, wo_pred_unmon_counter) = level
+        results[configs[tasks[i][-1][0]]].append([wo_pred_mon, wo_pred_unmon, wo_pred_mon_counter, wo_pred_unmon_counter])
+    return results
+
+def level_key(inputs, task, seed, compact):
+    '''Returns the cache key of the popularity level of a task from
+    sim_tasks(), for the digest() of the labels and predictions.
+
+    The key covers everything the simulated predictions of the level depend on.
+    Since the seeds of a level only depend on the seed and the level, see
+    seed_streams(), changing max_alexa or the other configs of a sweep does not
+    change the key.
+    '''
+    (timeframe, probability, fpr, scale_tor, lazy, analytic), p = task[0], task[1]
+    return level_cache.digest("level", inputs, int(timeframe), float(probability),
+        float(fpr), float(scale_tor), bool(lazy), bool(analytic), p, seed, compact)
+
+def sim_wf_wo_repeat(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                    config,             # (timeframe, probability, fpr, scale_tor)
+                    repetitions, num_thresholds=16, max_alexa=4, lazy=True,
+                    jobs=1, seed=None, analytic=False):
+    '''Simulates WF+WO for one config repetitions times, with independent
+    random draws, to get confidence intervals for the metrics.
+
+    Each repetition is simulated like sim_wf_wo_sweep(..., compact=True), but
+    as soon as both halves of a popularity level are done, only the recall and
+    precision of metrics_curve() are kept, so the simulated
+    predictions of all repetitions are never in memory at once. Repetition r
+    uses the seed_streams() of child r of the SeedSequence of the seed, and the
+    repetitions are simulated in parallel with a pool of jobs processes.
+
+    Returns a dict of arrays: the popularity levels, the thresholds (only for
+    probabilities), the recall and precision for each repetition, level, and
+    threshold, and the number of oracle calls for each repetition and level.
+    See load_repetitions().
+    '''
+    data = sim_data(labels_mon, labels_unmon, pred_mon, pred_unmon, True)
+    if data == -1:
+        return -1
+
+    popularity = [pow(10,i) for i in range(0,max_alexa+1)]
+    seed_seq = np.random.SeedSequence(seed)
+    print("seed for this simulation: {}".format(seed_seq.entropy))
+    print("simulating WF+WO {} times with timeframe {} ms, probability {}, fpr = {}, lazy = {}, scale Tor = {}, analytic = {}".format(repetitions, *config[:3], lazy, config[3], analytic))
+    tasks = []
+    for r, seed_rep in enumerate(seed_seq.spawn(repetitions)):
+        tasks += sim_tasks((*config, lazy, analytic), popularity, seed_streams(seed_rep, len(popularity)), r)
+
+    prob = pred_type_list_of_prob(pred_mon)
+    threshold = metrics.thresholds(num_thresholds) if prob else [0]
+    lookups = metrics.label_lookup(labels_mon), metrics.label_lookup(labels_unmon)
+    shape = (repetitions, len(popularity))
+    results = {"popularity": np.array(popularity),
+        "recall": np.zeros(shape+(len(threshold),)), "precision": np.zeros(shape+(len(threshold),)),
+        "mon_counter": np.zeros(shape, dtype=np.int64), "unmon_counter": np.zeros(shape, dtype=np.int64)}
+    if prob:
+        results["thresholds"] = threshold
+
+    # the tasks come in pairs, so each step takes both halves of a level
+    done = sim_run(data, tasks, jobs)
+    for task, (wo_pred_mon, mon_counter), (wo_pred_unmon, unmon_counter) in zip(tasks[::2], done, done):
+        if not prob: # a single label is a probability of 1 for that label
+            wo_pred_mon = wo_pred_mon[0], np.ones(len(wo_pred_mon[0]))
+            wo_pred_unmon = wo_pred_unmon[0], np.ones(len(wo_pred_unmon[0]))
+        tp, fpp, fnp, tn, fn, accuracy, recall, precision = metrics.metrics_curve(threshold,
+            wo_pred_mon, labels_mon, wo_pred_unmon, labels_unmon, *lookups)
+        r, i = task[-1]
+        results["recall"][r, i], results["precision"][r, i] = recall, precision
+        results["mon_counter"][r, i], results["unmon_counter"][r, i] = mon_counter, unmon_counter
+    return results
+
+def sim_data(labels_mon, labels_unmon, pred_mon, pred_unmon, compact=False, stream=None):
+    '''Returns the data shared by all tasks of a simulation, see sim_worker().
+
+    For probabilities, the first label each test case asks the oracle about is
+    the same for every task, so it is computed once here and passed on to
+    wf_wo_list_prob().
+    '''
+    sim_fp, extra = sim_wf_wo, [(), ()]
+    if pred_type_single_pred(pred_mon):
+        print("each prediction is a single label, using wf_wo_single()")
+        sim_fp = wf_wo_single
+    if pred_type_list_of_prob(pred_mon):
+        print("each prediction is a list of probabilities, using wf_wo_list_prob()")
+        sim_fp = wf_wo_list_prob
+        extra = [(np.argmax(np.asarray(pred_mon), axis=1),),
+                 (np.argmax(np.asarray(pred_unmon), axis=1),)]
+    if sim_fp == sim_wf_wo:
+        print("failed to find an appropriate function for wf+wo sim, this shouldn't have gotten past the check function")
+        return -1
+
+    return {"sim_fp": sim_fp, "unmon_label": labels_unmon[0],
+            "labels": [labels_mon, labels_unmon],
+            "pred": [pred_mon, pred_unmon], "extra": extra,
+            "compact": compact, "stream": stream}
+
+def sim_tasks(oracle, popularity, streams, c):
+    '''Returns the monitored and unmonitored task of each popularity level for
+    sim_worker(), with the oracle parameters (timeframe, probability, fpr,
+    scale_tor, lazy, analytic), the seed_streams() and c as the first index
+    of the position of each task.
+    '''
+    tasks = []
+    for i, (p, (seed_tor, seed_mon, seed_unmon)) in enumerate(zip(popularity, streams)):
+        tasks.append((oracle, p, 0, seed_tor, seed_mon, (c, i)))
+        tasks.append((oracle, p, 1, seed_tor, seed_unmon, (c, i)))
+    return tasks
+
+def sim_run(data, tasks, jobs=1):
+    '''Yields the simulated predictions and number of oracle calls of
+    sim_worker() for each task, in order, either from this process or from a
+    pool of jobs processes. The profile of each task is recorded here.
+
+    In this process, data is passed to each sim_worker() rather than kept in
+    worker_data, so that nothing is left behind for the next call.
+    '''
+    data = dict(data, profile=profiling.tracing())
+    if jobs > 1:
+        with multiprocessing.Pool(jobs, sim_worker_init, (data,)) as pool:
+            for wo_pred, counter, profile in pool.imap(sim_worker, tasks):
+                profiling.add(profile)
+                yield wo_pred, counter
+    else:
+        for task in tasks:
+            wo_pred, counter, profile = sim_worker(task, data)
+            profiling.add(profile)
+            yield wo_pred, counter
+
+def seed_streams(seed_seq, levels):
+    '''Spawns the seeds for each popularity level from a SeedSequence.
+
+    Each level gets a child, which in turn spawns three seeds: one to simulate
+    the (lazy) Tor network, shared by the monitored and unmonitored tasks of the
+    level, and one for the oracle of each task. Children only depend on their
+    index, so adding levels leaves the seeds of the existing ones unchanged.
+    '''
+    return [seed_level.spawn(3) for seed_level in seed_seq.spawn(levels)]
+
+# the labels and predictions for the tasks of sim_wf_wo_sweep(), passed once
+# per worker process of sim_run() rather than once per task
+worker_data = {}
+
+def sim_worker_init(data):
+    worker_data.update(data)
+    if data["profile"]:
+        profiling.start()
+
+def sim_worker(task, data=None):
+    '''Simulates one half (0 monitored, 1 unmonitored) of a popularity level,
+    with data from sim_run(), or worker_data if None.
+
+    Returns the simulated predictions, the number of oracle calls, and a
+    profile of the task for profiling.add().
+    '''
+    (timeframe, probability, fpr, scale_tor, lazy, analytic), p, half, seed_tor, seed_half, position = task
+    d = worker_data if data is None else data
+
+    print("\tAlexa monitored websites starting rank {}, simulating predictions for {}".format(p, ["monitored", "unmonitored"][half]))
+    with profiling.measure(stage="simulate {}".format(["monitored", "unmonitored"][half]),
+            rank=p, config=task[0], position=position) as profile:
+        o, counter = create_oracle(timeframe, p, probability, fpr, lazy, scale_tor,
+                        np.random.default_rng(seed_half), np.random.default_rng(seed_tor),
+                        analytic)
+        if d["stream"] is not None:
+            sim_worker_stream(d, o, half, position)
+            wo_pred = None
+        else:
+            wo_pred = d["sim_fp"](o, d["pred"][half], d["labels"][half], d["unmon_label"], *d["extra"][half])
+            if d["compact"]:
+                wo_pred = summarize(wo_pred)
+        profile["oracle"] = dict(zip(ORACLE_COUNTS, counter))
+    return wo_pred, counter[0], profile
+
+def sim_worker_stream(d, o, half, position):
+    '''Simulates one half of a popularity level in chunks for sim_wf_wo_stream(),
+    with the data d of sim_worker().
+
+    Each chunk is summarize()d and written to its place in the memory-mapped
+    columns before the next chunk is read, with the same oracle for all chunks.
+    '''
+    chunk, parts = d["stream"]
+    pred, labels, extra = d["pred"][half], d["labels"][half], d["extra"][half]
+    c, i = position
+
+    columns = []
+    for column in ["label", "prob"]:
+        path = os.path.join(parts, "{}_{}.npy".format(["mon", "unmon"][half], column))
+        columns.append(np.load(path, mmap_mode="r+") if os.path.exists(path) else None)
+    for start in range(0, len(pred), chunk):
+        end = min(start+chunk, len(pred))
+        wo_pred = d["sim_fp"](o, pred[start:end], labels[start:end], d["unmon_label"], *[e[start:end] for e in extra])
+        for column, values in zip(columns, summarize(wo_pred)):
+            if column is not None:
+                column[c, i, start:end] = values
+    for column in columns:
+        if column is not None:
+            column.flush()
+
+def sim_wf_wo_stream(filename, labels_mon, labels_unmon, pred_mon, pred_unmon,
+                    configs, max_alexa=4, lazy=True, jobs=1, seed=None, chunk=10000,
+                    analytic=False):
+    '''Like sim_wf_wo_sweep(..., compact=True) followed by save_compact(), but
+    for predictions too large to be simulated all at once.
+
+    Each task simulates chunk test cases at a time and writes their labels and
+    probabilities to memory-mapped columns in a temporary directory next to
+    filename, so memory use is bounded by the chunk size as long as the
+    predictions are memory-mapped too (a .npy file, see load_array()). The
+    columns are then packed into filename in the format of save_compact().
+    Duplicate configs are only simulated and saved once.
+    '''
+    configs = list(dict.fromkeys(configs))
+    levels = max_alexa+1
+    prob = pred_type_list_of_prob(pred_mon)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(filename))) as parts:
+        for half, n in [("mon", len(labels_mon)), ("unmon", len(labels_unmon))]:
+            np.lib.format.open_memmap(os.path.join(parts, half+"_label.npy"), "w+",
+                np.int32, (len(configs), levels, n))
+            if prob:
+                np.lib.format.open_memmap(os.path.join(parts, half+"_prob.npy"), "w+",
+                    np.asarray(pred_mon[0]).dtype, (len(configs), levels, n))
+
+        results = sim_wf_wo_sweep(labels_mon, labels_unmon, pred_mon, pred_unmon,
+                    configs, max_alexa, lazy, jobs, seed, True, (chunk, parts),
+                    analytic)
+        if results == -1:
+            return -1
+
+        arrays = {"configs": np.array(configs, dtype=np.float64),
+                  "popularity": np.array([pow(10,i) for i in range(0,levels)])}
+        for h, half in enumerate(["mon", "unmon"]):
+            arrays[half+"_counter"] = np.array([[r[2+h] for r in results[c]] for c in configs])
+            for column in ["label", "prob"]:
+                path = os.path.join(parts, "{}_{}.npy".format(half, column))
+                if os.path.exists(path):
+                    arrays[half+"_"+column] = np.load(path, mmap_mode="r")
+        np.savez(filename, **arrays)
+
+def wf_wo_single(oracle, predictions, labels, unmon_label):
+    predictions = np.asarray(predictions)
+
+    # only predictions of monitored websites are checked with the oracle, all
+    # at once, and those the oracle says were not visited become unmonitored
+    asked = np.flatnonzero(predictions < unmon_label)
+    visited = oracle.batch(predictions[asked], np.asarray(labels)[asked])
+
+    predictions_updated = predictions.copy()
+    predictions_updated[asked[~visited]] = unmon_label
+    return predictions_updated
+
+def wf_wo_list_prob(oracle, predictions, labels, unmon_label, first=None):
+    '''Simulates WF+WO for predictions with probabilities.
+
+    If given, first is np.argmax() of each prediction, for callers that
+    simulate the same predictions many times. Later labels could be taken
+    from a ranking of the original probabilities as well, but that saves
+    nothing: each update below is a softmax of the probabilities of the
+    previous round, so the final probabilities have no closed form and every
+    rejected label needs a pass over the whole row either way.
+    '''
+    # one row of probabilities per test case, updated in place
+    predictions_updated = np.array(predictions)
+    labels = np.asarray(labels)
+
+    # loop until the highest probability label of each test case either is the
+    # unmonitored label or a label for a website that has been visited
+    # according to the simulated website oracle, each round only covering the
+    # test cases that are not done yet
+    active = np.arange(len(predictions_updated))
+    for r in range(predictions_updated.shape[1]):
+        if len(active) == 0:
+            break
+        if r == 0 and first is not None:
+            label_pred = np.asarray(first)
+        else:
+            label_pred = np.argmax(predictions_updated[active], axis=1)
+
+        # done if already classified as unmonitored or visited
+        asked = label_pred < unmon_label
+        active, label_pred = active[asked], label_pred[asked]
+        visited = oracle.batch(label_pred, labels[active])
+        active, label_pred = active[~visited], label_pred[~visited]
+
+        # oracle says not visited, so probability of being correct is 0
+        rows = predictions_updated[active]
+        rows[np.arange(len(active)), label_pred] = 0.0
+
+        # Update probabilities, using the method detailed in the WF+WO
+        # paper. This method worked OK given how we defined thresholds for
+        # DF, as is done in the metrics script. The softmax is done in place
+        # on the rows, with the same operations as softmax().
+        rows_max = rows.max(axis=1, keepdims=True)
+        np.multiply(rows, 5, out=rows)
+        np.divide(rows, rows_max, out=rows)
+        np.exp(rows, out=rows)
+        np.divide(rows, np.sum(rows, axis=1, keepdims=True), out=rows)
+        predictions_updated[active] = rows
+
+    return predictions_updated
+
+# thank you https://stackoverflow.com/questions/34968722/how-to-implement-the-softmax-function-in-python
+def softmax(x, axis=0):
+    """Compute softmax values for each sets of scores in x."""
+    e = np.exp(x)
+    return e / np.sum(e, axis=axis, keepdims=True)